@@ -0,0 +1,152 @@
+import os
+import subprocess
+import wave
+
+import numpy
+
+from frame_store import CHANNELS, SAMPLE_RATE, get_ffmpeg_binary
+from notes import get_note_starts, mapping_to_timestamps
+from pitch_shift import shift_audio_many
+from tracing import traced
+
+CROSSFADE_MS = float(os.environ.get("CROSSFADE_MS", "5"))
+
+
+@traced(category="decode")
+def load_actor_audio(video_path, sample_rate=SAMPLE_RATE):
+    """
+    Decode only the audio track of the actor video as float32 stereo PCM.
+    """
+    command = [
+        get_ffmpeg_binary(),
+        "-loglevel", "error",
+        "-i", video_path,
+        "-vn",
+        "-f", "f32le",
+        "-ac", str(CHANNELS),
+        "-ar", str(sample_rate),
+        "-",
+    ]
+    data = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+    return numpy.frombuffer(data, dtype=numpy.float32).reshape(-1, CHANNELS)
+
+
+def slice_note_audio(actor_audio, mapping_data, sample_rate=SAMPLE_RATE):
+    """
+    Views of the actor PCM for every mapped note.
+    """
+    note_audio = {}
+    for note, mapping in mapping_data.items():
+        start, end = mapping_to_timestamps(mapping, sample_rate)
+        note_audio[note] = actor_audio[
+            int(round(start * sample_rate)) : int(round(end * sample_rate))
+        ]
+    return note_audio
+
+
+@traced(category="shift")
+def shift_note_audio(note_audio, resolved):
+    """
+    Pitch shift every unique (mapped note, semitone shift) pair once, batching
+    all notes that need the same shift into one call.
+    """
+    shifted = {}
+    by_steps = {}
+    for resolution in resolved:
+        if resolution is None or resolution in shifted:
+            continue
+        find_note, steps = resolution
+        source = numpy.asarray(note_audio[find_note], dtype=numpy.float32)
+        if steps:
+            by_steps.setdefault(steps, []).append(resolution)
+            shifted[resolution] = None
+        else:
+            shifted[resolution] = source
+    for steps, resolutions in by_steps.items():
+        sources = [
+            numpy.asarray(note_audio[find_note], dtype=numpy.float32)
+            for find_note, _ in resolutions
+        ]
+        for resolution, result in zip(resolutions, shift_audio_many(sources, steps)):
+            shifted[resolution] = numpy.asarray(result, dtype=numpy.float32)
+    return shifted
+
+
+@traced(category="audio")
+def render_audio(
+    note_audio,
+    resolved,
+    notes,
+    sample_rate=SAMPLE_RATE,
+    crossfade_ms=CROSSFADE_MS,
+    shifted=None,
+):
+    """
+    Render the whole song into one preallocated buffer. Each note plays for at
+    most its duration, a note cut short keeps ringing for crossfade_ms while
+    fading out under the fade in of the next one. shifted can hold the output
+    of shift_note_audio when it is shared between renders.
+    """
+    starts, durations = get_note_starts(notes)
+    total = starts[-1] + durations[-1] if len(starts) else 0
+    audio = numpy.zeros((int(round(total * sample_rate)), CHANNELS), numpy.float32)
+    if shifted is None:
+        shifted = shift_note_audio(note_audio, resolved)
+    mix_notes(audio, 0, resolved, starts, durations, shifted, sample_rate, crossfade_ms)
+    return audio
+
+
+def get_note_end(source, start, duration, sample_rate, fade):
+    """
+    Sample after the last one a note starting at sample start adds, fade
+    included, before the song length cuts it.
+    """
+    length = min(len(source), int(round(duration * sample_rate)))
+    return min(start + length + fade, start + len(source))
+
+
+def mix_notes(audio, offset, resolved, starts, durations, shifted, sample_rate=SAMPLE_RATE, crossfade_ms=CROSSFADE_MS):
+    """
+    Add notes into audio, a buffer holding the song from sample offset on.
+    Anything past the end of the buffer is dropped.
+    """
+    fade = int(sample_rate * crossfade_ms / 1000)
+    ramp = numpy.linspace(0, 1, fade, endpoint=False, dtype=numpy.float32)[:, None]
+    for i, resolution in enumerate(resolved):
+        if resolution is None:
+            continue
+        source = shifted[resolution]
+        start = int(round(starts[i] * sample_rate))
+        end = min(get_note_end(source, start, durations[i], sample_rate, fade), offset + len(audio))
+        if end <= start:
+            continue
+        segment = source[: end - start] * 1  # Copy, sources are shared
+        if fade:
+            edge = min(fade, len(segment))
+            segment[:edge] *= ramp[:edge]
+            segment[-edge:] *= ramp[:edge][::-1]
+        audio[start - offset : end - offset] += segment
+
+
+def get_store_note_audio(store):
+    return {note: store.audio(note) for note in store.notes}
+
+
+def render_store_audio(store, resolved, notes, crossfade_ms=CROSSFADE_MS, shifted=None):
+    return render_audio(
+        get_store_note_audio(store),
+        resolved,
+        notes,
+        store.sample_rate,
+        crossfade_ms,
+        shifted,
+    )
+
+
+def write_wav(path, audio, sample_rate=SAMPLE_RATE):
+    pcm = (numpy.clip(audio, -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from zipfile import BadZipFile
+
+from frame_store import CACHE_FOLDER, file_fingerprint
+from segmentation import (
+    MIN_SILENCE_LEN,
+    SILENCE_OFFSET,
+    detect_nonsilent,
+    load_energy,
+    read_energy,
+    split_onsets,
+)
+from video_to_json import (
+    DATA_FOLDER,
+    audio_to_samples,
+    fix_input_path,
+    get_file_name_meta,
+    get_note_names,
+    input_string,
+    samples_to_dict,
+)
+
+ENERGY_FOLDER = os.path.join(CACHE_FOLDER, "energy")
+CALIBRATE_WORKERS = int(os.environ.get("CALIBRATE_WORKERS", "0")) or os.cpu_count()
+RETRY_SILENCE_LENS = [100, 150, 200, 250, 300, 400, 500]
+RETRY_SILENCE_OFFSETS = [8, 10, 12, 14, 16, 18, 20, 24, 28, 32]
+RETRY_ONSET_DBS = [6, 9, 12]
+MAX_SUGGESTIONS = 3
+
+
+def load_manifest(manifest_path):
+    """
+    A manifest is either a list of entries or {"defaults": {...}, "videos": [...]}.
+    Each entry needs "video" and may set "notes" (the spoken characters),
+    "actor", "min_silence_len", "silence_offset" and "onset_db".
+    """
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"videos": manifest}
+    defaults = manifest.get("defaults", {})
+    entries = []
+    for entry in manifest["videos"]:
+        if isinstance(entry, str):
+            entry = {"video": entry}
+        entries.append({**defaults, **entry})
+    return entries
+
+
+def get_signal(video_path, actor):
+    """
+    Energy of video_path, reused from an earlier calibration when the video
+    has not changed since. Entries are named by the video's fingerprint and
+    written whole, so parallel entries never read a half written file.
+    """
+    fingerprint = {"video": os.path.abspath(video_path), **file_fingerprint(video_path)}
+    key = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(ENERGY_FOLDER, f"{actor}_{key}.npz")
+    try:
+        return load_energy(path)
+    except (OSError, ValueError, KeyError, BadZipFile):
+        pass
+    signal = read_energy(video_path)
+    os.makedirs(ENERGY_FOLDER, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=".npz", dir=ENERGY_FOLDER)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            signal.save(f)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return signal
+
+
+def find_spans(signal, min_silence_len, silence_offset, onset_db):
+    spans = detect_nonsilent(signal, min_silence_len, signal.dBFS - silence_offset)
+    if onset_db is not None:
+        spans = split_onsets(signal, spans, onset_db)
+    return spans
+
+
+def suggest_thresholds(signal, expected, min_silence_len, silence_offset):
+    """
+    Settings closest to the requested ones that produce the expected number
+    of spans, found by re-thresholding the stored energy.
+    """
+    candidates = sorted(
+        (
+            (length, offset)
+            for length in RETRY_SILENCE_LENS
+            for offset in RETRY_SILENCE_OFFSETS
+        ),
+        key=lambda c: (
+            abs(c[1] - silence_offset) / SILENCE_OFFSET
+            + abs(c[0] - min_silence_len) / MIN_SILENCE_LEN
+        ),
+    )
+    suggestions = []
+    for onset_db in [None] + RETRY_ONSET_DBS:
+        for length, offset in candidates:
+            if len(find_spans(signal, length, offset, onset_db)) == expected:
+                suggestions.append(
+                    {"min_silence_len": length, "silence_offset": offset, "onset_db": onset_db}
+                )
+                if len(suggestions) >= MAX_SUGGESTIONS:
+                    return suggestions
+        if suggestions:
+            # Only split on onsets when plain silence thresholds cannot work
+            break
+    return suggestions
+
+
+def calibrate_entry(entry):
+    """
+    Segment one manifest entry and write its mapping. Never raises, the outcome
+    is reported in the returned dict.
+    """
+    started = time.time()
+    result = {"video": entry["video"], "status": "error"}
+    try:
+        video_path = fix_input_path(entry["video"])
+        if video_path is None:
+            raise Exception(f"Could not find video file {entry['video']}")
+        actor = entry.get("actor") or get_file_name_meta(video_path)[0]
+        names = get_note_names(entry["notes"]) if entry.get("notes") else input_string
+        min_silence_len = int(entry.get("min_silence_len", MIN_SILENCE_LEN))
+        silence_offset = float(entry.get("silence_offset", SILENCE_OFFSET))
+        onset_db = entry.get("onset_db")
+        result.update(
+            actor=actor,
+            expected=len(names),
+            min_silence_len=min_silence_len,
+            silence_offset=silence_offset,
+            onset_db=onset_db,
+        )
+
+        signal = get_signal(video_path, actor)
+        spans = find_spans(signal, min_silence_len, silence_offset, onset_db)
+        result.update(found=len(spans), dBFS=signal.dBFS)
+        if len(spans) == len(names):
+            out_path = os.path.join(DATA_FOLDER, f"{actor}.json")
+            with open(out_path, "w") as f:
+                json.dump(
+                    samples_to_dict(audio_to_samples(spans, signal.sample_rate), names),
+                    f,
+                    indent=4,
+                    ensure_ascii=False,
+                )
+            result.update(status="ok", output=out_path)
+        else:
+            result.update(
+                status="mismatch",
+                suggestions=suggest_thresholds(
+                    signal, len(names), min_silence_len, silence_offset
+                ),
+            )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.time() - started, 3)
+    return result
+
+
+def calibrate_manifest(entries, workers=CALIBRATE_WORKERS):
+    results = [None] * len(entries)
+    with ProcessPoolExecutor(max(1, min(workers, len(entries)))) as executor:
+        futures = {
+            executor.submit(calibrate_entry, entry): i for i, entry in enumerate(entries)
+        }
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            print(f"[{result['status']}] {result['video']} ({result['seconds']}s)")
+    return results
+
+
+def format_suggestion(suggestion):
+    text = f"min_silence_len={suggestion['min_silence_len']} silence_offset={suggestion['silence_offset']}"
+    if suggestion["onset_db"] is not None:
+        text += f" onset_db={suggestion['onset_db']}"
+    return text
+
+
+def print_report(results):
+    print()
+    print(f"{'Status':<10}{'Actor':<24}{'Spans':>12}  Details")
+    for result in results:
+        spans = f"{result.get('found', '-')}/{result.get('expected', '-')}"
+        if result["status"] == "ok":
+            details = result["output"]
+        elif result["status"] == "mismatch":
+            suggestions = result["suggestions"]
+            details = (
+                "retry with " + format_suggestion(suggestions[0])
+                if suggestions
+                else "no thresholds found, check the recording"
+            )
+        else:
+            details = result["error"]
+        print(f"{result['status']:<10}{result.get('actor', '-'):<24}{spans:>12}  {details}")
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    print(" | ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <manifest.json> [<report.json>]")
+        print("Manifest example:")
+        print('\t{"defaults": {"silence_offset": 16}, "videos": [{"video": "thethiny", "notes": "C C# D"}]}')
+        sys.exit(1)
+
+    manifest_path = sys.argv[1]
+    report_path = (
+        sys.argv[2]
+        if len(sys.argv) > 2
+        else os.path.splitext(manifest_path)[0] + "_report.json"
+    )
+
+    entries = load_manifest(manifest_path)
+    print(f"Calibrating {len(entries)} videos with {CALIBRATE_WORKERS} workers")
+    results = calibrate_manifest(entries)
+    print_report(results)
+
+    with open(report_path, "w") as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    print(f"Report saved to {report_path}")
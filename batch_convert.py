@@ -0,0 +1,117 @@
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from midi_convertor import SONG_FORMAT, convert_midi
+
+CONVERT_WORKERS = int(os.environ.get("CONVERT_WORKERS", "0")) or os.cpu_count()
+SONGS_FOLDER = "songs"
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+
+def find_midi_files(pattern):
+    """
+    Every MIDI file under a folder, or matching a glob, and the folder their
+    output paths are made relative to.
+    """
+    if os.path.isdir(pattern):
+        paths = [
+            os.path.join(folder, name)
+            for folder, _, names in os.walk(pattern)
+            for name in names
+            if name.lower().endswith(MIDI_EXTENSIONS)
+        ]
+        return sorted(paths), pattern
+    paths = sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ""
+    return paths, root
+
+
+def get_out_base(midi_path, root, out_folder):
+    """
+    out_folder mirrors the input folders, so songs with the same name in
+    different folders do not overwrite each other.
+    """
+    relative = os.path.relpath(os.path.splitext(midi_path)[0], root or ".")
+    return os.path.join(out_folder, relative)
+
+
+def convert_entry(midi_path, out_base, song_format, separator_size_user):
+    """
+    Convert one file. Never raises, the outcome is reported in the returned dict.
+    """
+    started = time.time()
+    result = {"midi": midi_path, "status": "error"}
+    try:
+        os.makedirs(os.path.dirname(out_base) or ".", exist_ok=True)
+        result.update(convert_midi(midi_path, out_base, song_format, separator_size_user))
+        result["status"] = "partial" if result["failed"] else "ok"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.time() - started, 3)
+    return result
+
+
+def convert_batch(paths, root, out_folder=SONGS_FOLDER, song_format=SONG_FORMAT, separator_size_user=None, workers=CONVERT_WORKERS):
+    results = [None] * len(paths)
+    with ProcessPoolExecutor(max(1, min(workers, len(paths)))) as executor:
+        futures = {
+            executor.submit(
+                convert_entry,
+                path,
+                get_out_base(path, root, out_folder),
+                song_format,
+                separator_size_user,
+            ): i
+            for i, path in enumerate(paths)
+        }
+        for future in tqdm(as_completed(futures), desc="MIDI files", total=len(futures)):
+            result = results[futures[future]] = future.result()
+            if result["status"] == "error":
+                tqdm.write(f"[error] {result['midi']}: {result['error']}")
+    return results
+
+
+def get_summary(results, seconds):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {
+        "files": len(results),
+        "statuses": counts,
+        "notes": sum(result.get("notes", 0) for result in results),
+        "outputs": sum(len(result.get("outputs", [])) for result in results),
+        "failed_tracks": sum(len(result.get("failed", [])) for result in results),
+        "seconds": round(seconds, 3),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <midi_folder or glob> [<out_folder>] [<separator_size>]")
+        print("Set SONG_FORMAT to events, text or both and CONVERT_WORKERS to the process count")
+        sys.exit(1)
+
+    out_folder = sys.argv[2] if len(sys.argv) > 2 else SONGS_FOLDER
+    separator_size_user = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    paths, root = find_midi_files(sys.argv[1])
+    if not paths:
+        print(f"No MIDI files found in {sys.argv[1]}")
+        sys.exit(1)
+
+    print(f"Converting {len(paths)} MIDI files to {SONG_FORMAT} with {CONVERT_WORKERS} workers")
+    started = time.time()
+    results = convert_batch(paths, root, out_folder, SONG_FORMAT, separator_size_user)
+    summary = get_summary(results, time.time() - started)
+    print(" | ".join(f"{status}: {count}" for status, count in sorted(summary["statuses"].items())))
+    print(f"{summary['notes']} notes, {summary['outputs']} songs written in {summary['seconds']:.1f}s")
+
+    manifest_path = os.path.join(out_folder, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump({"summary": summary, "files": results}, f, indent=4, ensure_ascii=False)
+    print(f"Manifest saved to {manifest_path}")
@@ -0,0 +1,261 @@
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from audio_render import render_store_audio, write_wav
+from daemon import DEFAULT_ENGINE, WarmActor
+from encoder_profiles import get_default_profile_name, get_profile, resolve_threads
+from main import ENGINES, get_engine, get_output_file, get_track_name, load_song
+from pitch_resolver import resolve_notes
+from proxy import DRAFT, DRAFT_CODEC
+from tracing import get_peak_memory
+
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "0")) or max(1, os.cpu_count() // 2)
+# Engines that run their own pool of encoders
+POOLED_ENGINES = ("chunked", "concat", "incremental")
+
+
+def load_matrix(matrix_path):
+    """
+    A job matrix is a list of jobs or {"defaults": {...}, "actors": [...],
+    "songs": [...], "jobs": [...]}. Every actor is rendered with every song,
+    plus the explicit jobs. A job needs "actor" and "song" and may set
+    "track", "engine", "codec" and "draft". Jobs that would write the same
+    output file are rejected.
+    """
+    with open(matrix_path, "r") as f:
+        matrix = json.load(f)
+    if isinstance(matrix, list):
+        matrix = {"jobs": matrix}
+    defaults = {"track": None, "engine": DEFAULT_ENGINE, "codec": None, "draft": DRAFT, **matrix.get("defaults", {})}
+    entries = [
+        {"actor": actor, **(song if isinstance(song, dict) else {"song": song})}
+        for actor in matrix.get("actors", [])
+        for song in matrix.get("songs", [])
+    ]
+    entries += matrix.get("jobs", [])
+    jobs = []
+    outputs = {}
+    for entry in entries:
+        job = {**defaults, **entry}
+        job["draft"] = bool(job["draft"])
+        job["codec"] = job["codec"] or (DRAFT_CODEC if job["draft"] else get_default_profile_name())
+        if job["engine"] != "audio" and job["engine"] not in ENGINES:
+            raise ValueError(f"Unknown engine {job['engine']}, use one of {['audio', *ENGINES]}")
+        get_profile(job["codec"])  # Fail on unknown profiles before rendering anything
+        try:
+            track_name = get_track_name(job["song"], job["track"])
+        except ValueError:
+            track_name = str(job["track"])  # Unknown tracks fail their own job later
+        # Everything get_output_file names the file by, bpm and beat size follow from the song
+        output = (job["actor"], job["song"], track_name, job["draft"], job["engine"] == "audio")
+        if output in outputs:
+            raise ValueError(f"Jobs {outputs[output]} and {len(jobs)} write the same output file")
+        outputs[output] = len(jobs)
+        jobs.append(job)
+    # Jobs of an actor run back to back so few actors are warm at once
+    return sorted(jobs, key=lambda job: (job["actor"], job["draft"]))
+
+
+def load_songs(jobs):
+    """
+    Parse every song of the batch once. A song that fails is stored as its
+    exception and fails only its own jobs.
+    """
+    songs = {}
+    for job in jobs:
+        key = (job["song"], job["track"])
+        if key not in songs:
+            try:
+                songs[key] = load_song(*key)
+            except Exception as e:
+                songs[key] = e
+    return songs
+
+
+class ActorPool:
+    """
+    Warm actors shared by the jobs of a batch. Each one is prepared by the
+    first job that needs it and dropped after its last job.
+    """
+
+    def __init__(self, jobs):
+        self.remaining = {}
+        for job in jobs:
+            key = (job["actor"], job["draft"])
+            self.remaining[key] = self.remaining.get(key, 0) + 1
+        self.actors = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.prepared = 0
+
+    def acquire(self, key):
+        """
+        Returns the warm actor and the seconds spent preparing it, zero when
+        another job already did.
+        """
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            warm = self.actors.get(key)
+            if warm is not None:
+                return warm, 0.0
+            started = time.time()
+            warm = WarmActor(*key)
+            with self.lock:
+                self.actors[key] = warm
+                self.prepared += 1
+            return warm, time.time() - started
+
+    def release(self, key):
+        with self.lock:
+            self.remaining[key] -= 1
+            if not self.remaining[key]:
+                self.actors.pop(key, None)
+
+
+class BatchRenderer:
+    def __init__(self, jobs, workers=BATCH_WORKERS):
+        self.jobs = jobs
+        self.workers = workers
+        self.songs = load_songs(jobs)
+        self.actors = ActorPool(jobs)
+        self.resolved = {}
+        self.resolved_lock = threading.Lock()
+
+    def resolve(self, warm, song_key, notes):
+        """
+        Resolution of a song for an actor, shared by every actor with the same
+        mapped note names.
+        """
+        key = (tuple(warm.mapping), song_key)
+        with self.resolved_lock:
+            resolved = self.resolved.get(key)
+        if resolved is None:
+            resolved = resolve_notes(warm.mapping, notes)
+            with self.resolved_lock:
+                self.resolved[key] = resolved
+        return resolved
+
+    def run_job(self, job):
+        """
+        Render one job. Never raises, the outcome and timings are reported in
+        the returned dict.
+        """
+        started = time.time()
+        result = {**job, "status": "error", "timings": {}}
+        timings = result["timings"]
+        actor_key = (job["actor"], job["draft"])
+        try:
+            song = self.songs[(job["song"], job["track"])]
+            if isinstance(song, Exception):
+                raise song
+            bpm, beat_size, notes = song
+            warm, timings["prepare_actor"] = self.actors.acquire(actor_key)
+
+            step = time.time()
+            resolved = self.resolve(warm, (job["song"], job["track"]), notes)
+            shifted = warm.get_shifted(resolved)
+            timings["shift"] = time.time() - step
+
+            step = time.time()
+            out_file = get_output_file(job["actor"], job["song"], bpm, beat_size, job["draft"], job["track"])
+            if job["engine"] == "audio":
+                out_file = os.path.splitext(out_file)[0] + ".wav"
+                audio = render_store_audio(warm.store, resolved, notes, shifted=shifted)
+                write_wav(out_file, audio, warm.store.sample_rate)
+                duration = len(audio) / warm.store.sample_rate
+            else:
+                codec = get_profile(job["codec"])
+                # Encoders running side by side share the cores, pooled engines
+                # run workers encoders per job and take this fixed per encoder count
+                options = {"workers": max(1, os.cpu_count() // self.workers)} if job["engine"] in POOLED_ENGINES else {}
+                codec["threads"] = resolve_threads(codec, self.workers * options.get("workers", 1))
+                duration = get_engine(job["engine"])(
+                    out_file, warm.store, warm.mapping, notes, codec, shifted=shifted, **options
+                )
+            timings["render"] = time.time() - step
+            result.update(status="ok", out_file=out_file, duration=duration)
+        except Exception as e:
+            traceback.print_exc()
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            self.actors.release(actor_key)
+        timings.update({name: round(value, 3) for name, value in timings.items()})
+        result["seconds"] = round(time.time() - started, 3)
+        return result
+
+    def run(self):
+        results = [None] * len(self.jobs)
+        with ThreadPoolExecutor(max(1, min(self.workers, len(self.jobs)))) as executor:
+            futures = {executor.submit(self.run_job, job): i for i, job in enumerate(self.jobs)}
+            for future in as_completed(futures):
+                result = results[futures[future]] = future.result()
+                print(f"[{result['status']}] {result['actor']} / {result['song']} ({result['seconds']}s)")
+        return results
+
+
+def get_summary(results, seconds, renderer):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    rendered = sum(result.get("duration", 0) for result in results)
+    return {
+        "jobs": len(results),
+        "statuses": counts,
+        "workers": renderer.workers,
+        "actors_prepared": renderer.actors.prepared,
+        "songs_parsed": sum(not isinstance(song, Exception) for song in renderer.songs.values()),
+        "rendered_seconds": round(rendered, 3),
+        "seconds": round(seconds, 3),
+        "realtime_factor": round(rendered / seconds, 3) if seconds else None,
+        "peak_memory": get_peak_memory(),
+    }
+
+
+def print_report(results, summary):
+    print()
+    print(f"{'Status':<8}{'Actor':<20}{'Song':<24}{'Duration':>10}{'Seconds':>10}  Details")
+    for result in results:
+        details = result["out_file"] if result["status"] == "ok" else result["error"]
+        print(
+            f"{result['status']:<8}{result['actor']:<20}{result['song']:<24}"
+            f"{result.get('duration', 0):>10.2f}{result['seconds']:>10.2f}  {details}"
+        )
+    print(" | ".join(f"{status}: {count}" for status, count in sorted(summary["statuses"].items())))
+    print(
+        f"{summary['rendered_seconds']:.1f}s of video in {summary['seconds']:.1f}s"
+        f" ({summary['realtime_factor']}x realtime) | {summary['actors_prepared']} actors prepared"
+        f" | {summary['songs_parsed']} songs parsed"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <matrix.json> [<results.json>]")
+        print("Matrix example:")
+        print('\t{"defaults": {"engine": "pipe"}, "actors": ["thethiny"], "songs": ["test", {"song": "mtest", "track": "lead"}]}')
+        sys.exit(1)
+
+    matrix_path = sys.argv[1]
+    results_path = (
+        sys.argv[2]
+        if len(sys.argv) > 2
+        else os.path.splitext(matrix_path)[0] + "_results.json"
+    )
+
+    jobs = load_matrix(matrix_path)
+    renderer = BatchRenderer(jobs)
+    print(f"Rendering {len(jobs)} jobs with {renderer.workers} workers")
+    started = time.time()
+    results = renderer.run()
+    summary = get_summary(results, time.time() - started, renderer)
+    print_report(results, summary)
+
+    with open(results_path, "w") as f:
+        json.dump({"summary": summary, "jobs": results}, f, indent=4, ensure_ascii=False)
+    print(f"Results saved to {results_path}")
@@ -0,0 +1,328 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measure the shifts themselves, not the on-disk cache of an earlier run
+os.environ.setdefault("PITCH_CACHE", "false")
+
+import moviepy.editor as mp
+import numpy
+from moviepy.audio.AudioClip import AudioArrayClip
+
+from audio_render import render_store_audio, write_wav
+from chunked_render import render_song_chunked
+from encoder_profiles import get_moviepy_args, get_profile
+from frame_store import SAMPLE_RATE, build_frame_store, get_ffmpeg_binary, open_frame_store
+from main import get_moviepy_logger, get_note_video
+from notes import NOTES_ALPHABET, parse_notes, pitch_to_name
+from pipe_renderer import render_song
+from pitch_resolver import PitchResolver
+from segment_concat import render_song_concat
+from streaming import render_song_streaming
+from tracing import get_peak_memory
+from transformations import shift_pitch
+
+BENCH_FOLDER = os.path.join("cache", "benchmark")
+RESULTS_FOLDER = "benchmarks"
+BENCH_NOTES = int(os.environ.get("BENCH_NOTES", "64"))
+BENCH_BPM = int(os.environ.get("BENCH_BPM", "120"))
+BENCH_BEAT = float(os.environ.get("BENCH_BEAT", "4"))
+BENCH_OCTAVES = os.environ.get("BENCH_OCTAVES", "1-3")
+BENCH_REPEAT = int(os.environ.get("BENCH_REPEAT", "3"))
+BENCH_SEED = int(os.environ.get("BENCH_SEED", "0"))
+BENCH_STAGES = os.environ.get("BENCH_STAGES", "all").lower()
+VIDEO_SIZE = (320, 240)
+VIDEO_FPS = 30
+NOTE_SECONDS = 0.6
+GAP_SECONDS = 0.4
+NOISE_FLOOR = 0.05  # Relative change reported as noise by compare
+
+
+def get_note_frequency(pitch):
+    """
+    Frequency of a song pitch, C (12) is middle C.
+    """
+    return 261.63 * 2.0 ** ((pitch - 12) / 12)
+
+
+def make_actor_video(video_path, mapping_path, octave=1, size=VIDEO_SIZE, fps=VIDEO_FPS, sample_rate=SAMPLE_RATE):
+    """
+    Write an actor video that sings the twelve notes of octave, each as a tone
+    over a frame of its own colour, and the mapping of where they are.
+    """
+    width, height = size
+    slot = NOTE_SECONDS + GAP_SECONDS
+    duration = GAP_SECONDS + slot * len(NOTES_ALPHABET)
+    total_samples = int(round(duration * sample_rate))
+    audio = numpy.zeros((total_samples, 2), dtype=numpy.float32)
+    mapping = {}
+    colours = []
+    for i in range(len(NOTES_ALPHABET)):
+        pitch = octave * 12 + i
+        start = int(round((GAP_SECONDS + i * slot) * sample_rate))
+        length = int(round(NOTE_SECONDS * sample_rate))
+        t = numpy.arange(length) / sample_rate
+        tone = 0.5 * numpy.sin(2 * numpy.pi * get_note_frequency(pitch) * t) * numpy.hanning(length)
+        audio[start : start + length] = tone[:, None]
+        mapping[pitch_to_name(pitch)] = {"start": start, "length": length}
+        colours.append(((i * 53) % 256, (i * 97) % 256, (i * 151) % 256))
+
+    fd, audio_path = tempfile.mkstemp(suffix=".f32")
+    with os.fdopen(fd, "wb") as f:
+        f.write(audio.tobytes())
+    command = [
+        get_ffmpeg_binary(),
+        "-y",
+        "-loglevel", "error",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "-s", f"{width}x{height}",
+        "-r", str(fps),
+        "-i", "-",
+        "-f", "f32le",
+        "-ar", str(sample_rate),
+        "-ac", "2",
+        "-i", audio_path,
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-shortest",
+        video_path,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        frame = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+        for i in range(int(duration * fps)):
+            note = int((i / fps - GAP_SECONDS) // slot)
+            offset = (i / fps - GAP_SECONDS) - note * slot
+            frame[:] = colours[note] if 0 <= note < len(colours) and offset < NOTE_SECONDS else 0
+            process.stdin.write(frame.tobytes())
+        process.stdin.close()
+        if process.wait():
+            raise Exception(f"ffmpeg failed to write {video_path}")
+    finally:
+        os.remove(audio_path)
+    with open(mapping_path, "w") as f:
+        json.dump(mapping, f, indent=4)
+    return mapping
+
+
+def make_song(song_path, note_count, bpm, beat_size, octaves, seed=0):
+    """
+    Write a random song in the text format, with notes drawn from octaves
+    (low, high) and some held over several slots.
+    """
+    rng = numpy.random.default_rng(seed)
+    low, high = octaves
+    pitches = rng.integers(low * 12, (high + 1) * 12, note_count)
+    holds = rng.choice([0, 0, 0, 1, 3], note_count)
+    slots = []
+    for pitch, hold in zip(pitches, holds):
+        slots.append(pitch_to_name(int(pitch)))
+        slots.extend([""] * int(hold))
+    lines = [",".join(slots[i : i + 16]) for i in range(0, len(slots), 16)]
+    with open(song_path, "w", encoding="utf-8") as f:
+        f.write(f"{bpm} {beat_size:g}\n")
+        f.write("\n".join(lines))
+
+
+def get_octaves(text):
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+
+def time_stage(function, repeat):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start)
+    return result, {
+        "runs": runs,
+        "min": min(runs),
+        "median": float(numpy.median(runs)),
+        "mean": float(numpy.mean(runs)),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_config():
+    return {
+        "notes": BENCH_NOTES,
+        "bpm": BENCH_BPM,
+        "beat_size": BENCH_BEAT,
+        "octaves": list(get_octaves(BENCH_OCTAVES)),
+        "repeat": BENCH_REPEAT,
+        "seed": BENCH_SEED,
+        "video_size": list(VIDEO_SIZE),
+        "video_fps": VIDEO_FPS,
+        "codec": get_profile()["name"],
+        "pitch_cache": os.environ["PITCH_CACHE"],
+    }
+
+
+def run_benchmark(folder=BENCH_FOLDER, repeat=BENCH_REPEAT, stages=BENCH_STAGES):
+    """
+    Build the synthetic inputs in folder and time every stage of the
+    pipeline. Returns a dict ready to be written as JSON.
+    """
+    os.makedirs(folder, exist_ok=True)
+    config = get_config()
+    video_path = os.path.join(folder, "actor.mp4")
+    mapping_path = os.path.join(folder, "actor.json")
+    song_path = os.path.join(folder, "song.txt")
+    store_path = os.path.join(folder, "frames")
+    codec = get_profile()
+    timings = {}
+    outputs = {}
+
+    def enabled(stage):
+        return stages == "all" or stage in stages.split(",")
+
+    def stage(name, function, times=repeat):
+        result, timings[name] = time_stage(function, times)
+        print(f"{name:<16}{timings[name]['median']:>10.4f}s")
+        return result
+
+    mapping = stage("make_actor", lambda: make_actor_video(video_path, mapping_path), 1)
+    stage(
+        "make_song",
+        lambda: make_song(song_path, BENCH_NOTES, BENCH_BPM, BENCH_BEAT, get_octaves(BENCH_OCTAVES), BENCH_SEED),
+        1,
+    )
+    stage("frame_store", lambda: build_frame_store(video_path, mapping, store_path))
+    store = open_frame_store(video_path, mapping, store_path=store_path)
+
+    _, _, notes = stage("parse_notes", lambda: parse_notes(song_path))
+    resolver = PitchResolver(mapping)
+    resolved = stage("resolve", lambda: PitchResolver(mapping).resolve(notes))
+    required_shifts = resolver.required_shifts(notes)
+    outputs["notes"] = len(notes)
+    outputs["song_seconds"] = notes.duration
+    outputs["unique_shifts"] = sum(1 for _, shift in required_shifts if shift)
+
+    if enabled("shift_pitch"):
+        stage(
+            "shift_pitch",
+            lambda: [
+                shift_pitch(store.note_clip(note), shift)
+                for note, shift in required_shifts
+                if shift
+            ],
+        )
+    if enabled("audio"):
+        audio = stage("audio_render", lambda: render_store_audio(store, resolved, notes))
+        write_wav(os.path.join(folder, "song.wav"), audio)
+
+    if enabled("moviepy"):
+        clips = stage(
+            "get_note_video",
+            lambda: [
+                get_note_video(mapping, notes[i], store, store.sample_rate, False, resolved[i])
+                for i in range(len(notes))
+            ],
+        )
+        concat_clip = stage("concatenate", lambda: mp.concatenate_videoclips(clips))
+        concat_clip = concat_clip.set_audio(
+            AudioArrayClip(render_store_audio(store, resolved, notes), fps=SAMPLE_RATE)
+        )
+        out_file = os.path.join(folder, "song_moviepy.mp4")
+        stage(
+            "encode_moviepy",
+            lambda: concat_clip.write_videofile(
+                out_file,
+                logger=get_moviepy_logger(),
+                **get_moviepy_args(codec),
+            ),
+        )
+
+    for name, render in (
+        ("pipe", render_song),
+        ("concat", render_song_concat),
+        ("chunked", render_song_chunked),
+        ("stream", render_song_streaming),
+    ):
+        if enabled(name):
+            out_file = os.path.join(folder, f"song_{name}.mp4")
+            outputs[f"{name}_seconds"] = stage(
+                f"render_{name}", lambda: render(out_file, store, mapping, notes, codec)
+            )
+
+    # Whole run, stages share the process
+    outputs["peak_memory"] = get_peak_memory()
+    return {
+        "meta": {
+            "commit": get_commit(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": config,
+        },
+        "outputs": outputs,
+        "stages": timings,
+    }
+
+
+def compare_results(base, new, noise=NOISE_FLOOR):
+    """
+    Print the median time of every stage in both results and how it changed.
+    """
+    for key in sorted(set(base["meta"]["config"]) | set(new["meta"]["config"])):
+        before, after = base["meta"]["config"].get(key), new["meta"]["config"].get(key)
+        if before != after:
+            print(f"Warning: config {key} differs ({before} -> {after})")
+    print(f"{'Stage':<16}{base['meta']['commit'] or 'base':>10}{new['meta']['commit'] or 'new':>10}{'change':>10}")
+    for name in base["stages"]:
+        if name not in new["stages"]:
+            continue
+        before = base["stages"][name]["median"]
+        after = new["stages"][name]["median"]
+        change = (after - before) / before if before else 0.0
+        verdict = ""
+        if abs(change) > noise:
+            verdict = "faster" if change < 0 else "slower"
+        print(f"{name:<16}{before:>10.4f}{after:>10.4f}{change:>+10.1%}  {verdict}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("run", "compare") or (sys.argv[1] == "compare" and len(sys.argv) < 4):
+        print(f"Usage: python {sys.argv[0]} run [<results.json>]")
+        print(f"       python {sys.argv[0]} compare <base.json> <new.json>")
+        sys.exit(1)
+
+    if sys.argv[1] == "compare":
+        with open(sys.argv[2], "r") as f:
+            base = json.load(f)
+        with open(sys.argv[3], "r") as f:
+            new = json.load(f)
+        compare_results(base, new)
+    else:
+        results = run_benchmark()
+        results_path = (
+            sys.argv[2]
+            if len(sys.argv) > 2
+            else os.path.join(RESULTS_FOLDER, f"{results['meta']['commit'] or int(time.time())}.json")
+        )
+        os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+        with open(results_path, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results saved to {results_path}")
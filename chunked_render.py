@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+from tqdm import tqdm
+
+from audio_render import render_store_audio
+from encoder_profiles import resolve_threads
+from frame_store import FrameStore
+from notes import get_note_starts
+from pipe_renderer import compile_timeline, write_audio_file, write_frames
+from pitch_resolver import resolve_notes
+from segment_concat import concat_segments
+from tracing import span
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "0")) or os.cpu_count()
+
+
+def get_chunk_bounds(notes, fps, frame_count, chunks):
+    """
+    Split [0, frame_count) into at most chunks contiguous frame ranges, with
+    every cut moved to the nearest note start so chunks begin on a note.
+    """
+    starts, _ = get_note_starts(notes)
+    note_frames = numpy.unique(numpy.ceil(starts * fps - 1e-9).astype(numpy.int64))
+    note_frames = note_frames[(note_frames > 0) & (note_frames < frame_count)]
+    cuts = []
+    for i in range(1, chunks):
+        target = frame_count * i // chunks
+        if len(note_frames):
+            nearest = numpy.abs(note_frames - target).argmin()
+            target = int(note_frames[nearest])
+        cuts.append(target)
+    edges = sorted(set([0, *cuts, frame_count]))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def render_chunk(store_path, frame_indices, out_file, codec, threads):
+    """
+    Worker entry point, every process maps the same store read only.
+    """
+    store = FrameStore(store_path)
+    write_frames(out_file, store, frame_indices, codec, threads=threads, progress=False)
+    return out_file
+
+
+def render_song_chunked(out_file, store, mapping_data, notes, codec, workers=RENDER_WORKERS, shifted=None):
+    resolved = resolve_notes(mapping_data, notes)
+    frame_indices = compile_timeline(store, resolved, notes)
+    bounds = get_chunk_bounds(notes, store.fps, len(frame_indices), workers)
+    # Fixed per chunk thread count keeps the output independent of scheduling
+    threads = resolve_threads(codec, len(bounds))
+    print(f"Chunks: {len(bounds)} | Workers: {workers} | Threads per chunk: {threads}")
+    segment_folder = tempfile.mkdtemp(prefix="chunks_")
+    audio_path = write_audio_file(render_store_audio(store, resolved, notes, shifted=shifted))
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    render_chunk,
+                    store.store_path,
+                    frame_indices[start:end],
+                    os.path.join(segment_folder, f"chunk_{i}.mp4"),
+                    codec,
+                    threads,
+                )
+                for i, (start, end) in enumerate(bounds)
+            ]
+            with span("render_chunks", "encode", chunks=len(bounds)):
+                paths = [future.result() for future in tqdm(futures, desc="Chunks")]
+        concat_segments(out_file, paths, audio_path, store.sample_rate, codec)
+    finally:
+        os.remove(audio_path)
+        shutil.rmtree(segment_folder, ignore_errors=True)
+    return len(frame_indices) / store.fps
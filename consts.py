@@ -12,6 +12,45 @@ codecs = {
     {
         'codec': 'libx264',
         'audio_codec': 'aac',
+        'preset': 'medium',
+        'crf': 23,
+        'audio_bitrate': '192k',
+        'pixel_format': 'yuv420p',
+        'threads': 'auto',
+        'keyframe_interval': 250,
+    },
+    'fast':
+    {
+        'codec': 'libx264',
+        'audio_codec': 'aac',
+        'preset': 'veryfast',
+        'crf': 23,
+        'audio_bitrate': '192k',
+        'pixel_format': 'yuv420p',
+        'threads': 'auto',
+        'keyframe_interval': 250,
+    },
+    'archive':
+    {
+        'codec': 'libx264',
+        'audio_codec': 'aac',
+        'preset': 'slow',
+        'crf': 18,
+        'audio_bitrate': '320k',
+        'pixel_format': 'yuv420p',
+        'threads': 'auto',
+        'keyframe_interval': 250,
+    },
+    'draft':
+    {
+        'codec': 'libx264',
+        'audio_codec': 'aac',
+        'preset': 'ultrafast',
+        'crf': 32,
+        'audio_bitrate': '192k',  # Drafts keep full quality audio
+        'pixel_format': 'yuv420p',
+        'threads': 'auto',
+        'keyframe_interval': 120,
     },
     'mpeg4':
     {
@@ -0,0 +1,312 @@
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy
+
+from audio_render import get_store_note_audio, render_store_audio, shift_note_audio, write_wav
+from consts import codecs
+from encoder_profiles import get_default_profile_name, get_profile
+from frame_store import file_fingerprint, open_frame_store
+from main import DATA_FOLDER, ENGINES, get_engine, get_input_video_path, get_output_file, load_song
+from pitch_resolver import resolve_notes
+from pitch_shift import shift_batch
+from proxy import DRAFT_CODEC
+
+DAEMON_HOST = os.environ.get("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.environ.get("DAEMON_PORT", "8765"))
+DAEMON_WORKERS = int(os.environ.get("DAEMON_WORKERS", "2"))
+DAEMON_HISTORY = int(os.environ.get("DAEMON_HISTORY", "1000"))  # Finished jobs kept for polling
+DAEMON_ACTORS = int(os.environ.get("DAEMON_ACTORS", "4"))  # Warm actors kept, least recently used dropped first
+DAEMON_SHIFT_CACHE_MB = float(os.environ.get("DAEMON_SHIFT_CACHE_MB", "1024"))  # Shifted audio kept per actor
+DEFAULT_ENGINE = "pipe"
+
+
+class WarmActor:
+    """
+    Frame store, note audio and every pitch shift done so far for one actor,
+    kept in memory between jobs. Drafts use the actor's proxy video.
+    """
+
+    def __init__(self, actor, draft=False, shift_cache_mb=DAEMON_SHIFT_CACHE_MB):
+        self.actor = actor
+        self.source_path = os.path.join(DATA_FOLDER, f"{actor}.mp4")
+        self.mapping_path = os.path.join(DATA_FOLDER, f"{actor}.json")
+        self.fingerprint = self.get_fingerprint()
+        self.video_path = get_input_video_path(actor, draft)
+        with open(self.mapping_path, "r") as f:
+            self.mapping = json.load(f)
+        self.store = open_frame_store(self.video_path, self.mapping)
+        self.note_audio = get_store_note_audio(self.store)
+        self.shifted = {}
+        self.shifted_bytes = 0
+        self.shift_cache_bytes = shift_cache_mb * 1024 * 1024
+        self.lock = threading.Lock()
+
+    def get_fingerprint(self):
+        return file_fingerprint(self.source_path), file_fingerprint(self.mapping_path)
+
+    def is_current(self):
+        try:
+            return self.get_fingerprint() == self.fingerprint
+        except OSError:
+            return False
+
+    def get_shifted(self, resolved):
+        """
+        Shifted audio for every resolution in resolved, only the ones not
+        kept from earlier jobs are computed. The least recently used shifts
+        are dropped past the cache size, never the ones of this job.
+        """
+        with self.lock:
+            wanted = [resolution for resolution in dict.fromkeys(resolved) if resolution is not None]
+            missing = [resolution for resolution in wanted if resolution not in self.shifted]
+            if missing:
+                for resolution, audio in shift_note_audio(self.note_audio, missing).items():
+                    self.shifted[resolution] = audio
+                    self.shifted_bytes += audio.nbytes
+            shifted = {}
+            for resolution in wanted:
+                # Reinserting keeps the dict in least recently used order
+                shifted[resolution] = self.shifted[resolution] = self.shifted.pop(resolution)
+            for resolution in list(self.shifted):
+                if self.shifted_bytes <= self.shift_cache_bytes or resolution in shifted:
+                    break
+                self.shifted_bytes -= self.shifted.pop(resolution).nbytes
+            return shifted
+
+
+def check_name(value, field):
+    """
+    Actor and song names become paths under input/, songs/ and output/, so
+    they must be plain file names.
+    """
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{field} must be a non empty string")
+    if "/" in value or "\\" in value or ":" in value or value.strip() in (".", ".."):
+        raise ValueError(f"Invalid {field} {value!r}, path separators and .. are not allowed")
+    return value
+
+
+class RenderDaemon:
+    def __init__(self, workers=DAEMON_WORKERS, history=DAEMON_HISTORY, max_actors=DAEMON_ACTORS):
+        self.executor = ThreadPoolExecutor(workers)
+        self.workers = workers
+        self.history = history
+        self.max_actors = max_actors
+        self.actors = {}
+        self.actor_locks = {}
+        self.actors_lock = threading.Lock()
+        self.jobs = {}
+        self.finished = deque()
+        self.jobs_lock = threading.Lock()
+
+    def get_actor(self, actor, draft=False):
+        """
+        Warm actor, prepared under its own lock so jobs for other actors and
+        status requests do not wait for it. Only the max_actors most recently
+        used stay warm, running jobs keep their own reference.
+        """
+        key = (actor, draft)
+        with self.actors_lock:
+            lock = self.actor_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self.actors_lock:
+                warm = self.actors.get(key)
+            if warm is None or not warm.is_current():
+                warm = WarmActor(actor, draft)
+            with self.actors_lock:
+                self.actors.pop(key, None)
+                self.actors[key] = warm
+                while len(self.actors) > self.max_actors:
+                    dropped = next(iter(self.actors))
+                    del self.actors[dropped]
+                    self.actor_locks.pop(dropped, None)
+            return warm
+
+    def submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+        draft = bool(request.get("draft"))
+        engine = request.get("engine") or DEFAULT_ENGINE
+        codec = request.get("codec") or (DRAFT_CODEC if draft else get_default_profile_name())
+        if not request.get("actor") or not request.get("song"):
+            raise ValueError("actor and song are required")
+        check_name(request["actor"], "actor")
+        check_name(request["song"], "song")
+        if request.get("track") is not None and not isinstance(request["track"], (str, int)):
+            raise ValueError("track must be a name or an index")
+        if engine != "audio" and engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}, use one of {['audio', *ENGINES]}")
+        if codec not in codecs:
+            raise ValueError(f"Unknown codec {codec}, use one of {list(codecs)}")
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "actor": request["actor"],
+            "song": request["song"],
+            "track": request.get("track"),
+            "engine": engine,
+            "codec": codec,
+            "draft": draft,
+            "status": "queued",
+            "submitted": time.time(),
+        }
+        with self.jobs_lock:
+            self.jobs[job["id"]] = job
+        self.executor.submit(self.run, job)
+        return dict(job)
+
+    def update(self, job, **values):
+        with self.jobs_lock:
+            job.update(values)
+
+    def run(self, job):
+        started = time.time()
+        self.update(job, status="loading", started=started)
+        try:
+            warm = self.get_actor(job["actor"], job["draft"])
+            bpm, beat_size, notes = load_song(job["song"], job["track"])
+            out_file = get_output_file(job["actor"], job["song"], bpm, beat_size, job["draft"], job["track"])
+            self.update(job, status="shifting", notes=len(notes))
+            resolved = resolve_notes(warm.mapping, notes)
+            shifted = warm.get_shifted(resolved)
+            self.update(job, status="rendering")
+            if job["engine"] == "audio":
+                out_file = os.path.splitext(out_file)[0] + ".wav"
+                audio = render_store_audio(warm.store, resolved, notes, shifted=shifted)
+                write_wav(out_file, audio, warm.store.sample_rate)
+                duration = len(audio) / warm.store.sample_rate
+            else:
+                duration = get_engine(job["engine"])(
+                    out_file,
+                    warm.store,
+                    warm.mapping,
+                    notes,
+                    get_profile(job["codec"]),
+                    shifted=shifted,
+                )
+            self.update(
+                job,
+                status="done",
+                out_file=out_file,
+                duration=duration,
+                seconds=time.time() - started,
+            )
+        except Exception as e:
+            traceback.print_exc()
+            self.update(
+                job,
+                status="failed",
+                error=f"{type(e).__name__}: {e}",
+                seconds=time.time() - started,
+            )
+        finally:
+            self.finish(job)
+
+    def finish(self, job):
+        """
+        Mark job finished, dropping the oldest finished jobs past the history.
+        """
+        with self.jobs_lock:
+            job["finished"] = time.time()
+            self.finished.append(job["id"])
+            while len(self.finished) > self.history:
+                self.jobs.pop(self.finished.popleft(), None)
+
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def get_status(self):
+        with self.jobs_lock:
+            statuses = {}
+            for job in self.jobs.values():
+                statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        with self.actors_lock:
+            actors = {
+                f"{name}{' (draft)' if draft else ''}": {
+                    "notes": len(warm.mapping),
+                    "shifts": len(warm.shifted),
+                }
+                for (name, draft), warm in self.actors.items()
+            }
+        return {"workers": self.workers, "jobs": statuses, "actors": actors}
+
+
+def make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, code, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["status"]:
+                self.send_json(200, daemon.get_status())
+            elif parts == ["jobs"]:
+                with daemon.jobs_lock:
+                    jobs = [dict(job) for job in daemon.jobs.values()]
+                self.send_json(200, jobs)
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = daemon.get_job(parts[1])
+                self.send_json(200 if job else 404, job or {"error": "Unknown job"})
+            else:
+                self.send_json(404, {"error": "Unknown path"})
+
+        def do_POST(self):
+            if self.path.strip("/") != "jobs":
+                self.send_json(404, {"error": "Unknown path"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                job = daemon.submit(json.loads(self.rfile.read(length) or b"{}"))
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(202, job)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def warm_up():
+    """
+    Import every engine and run one tiny shift so the pitch backend is
+    imported and compiled before the first job arrives.
+    """
+    for name in ENGINES:
+        get_engine(name)
+    shift_batch([numpy.zeros((4096, 2), numpy.float32)], 1)
+
+
+def serve(host=DAEMON_HOST, port=DAEMON_PORT, workers=DAEMON_WORKERS):
+    daemon = RenderDaemon(workers)
+    warm_up()
+    server = ThreadingHTTPServer((host, port), make_handler(daemon))
+    print(f"Render daemon listening on http://{host}:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DAEMON_PORT
+    serve(port=port)
@@ -0,0 +1,221 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from consts import codecs
+
+DEFAULT_PROFILE = "mp4_alt"
+ENCODER_DEFAULTS_PATH = "encoder_defaults.json"
+PROFILE_DEFAULTS = {
+    "preset": None,
+    "crf": None,
+    "audio_bitrate": None,
+    "pixel_format": None,
+    "threads": "auto",
+    "keyframe_interval": None,
+}
+CALIBRATE_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+CALIBRATE_SIZE = os.environ.get("CALIBRATE_SIZE", "1280x720")
+CALIBRATE_FPS = 30
+
+
+def load_encoder_defaults(path=ENCODER_DEFAULTS_PATH):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_default_profile_name():
+    """
+    CODEC from the environment, else the calibrated profile, else mp4_alt.
+    """
+    return os.environ.get("CODEC") or load_encoder_defaults().get("profile") or DEFAULT_PROFILE
+
+
+def get_base_profile(name):
+    """
+    Settings of an encoder profile as written in consts.codecs.
+    """
+    if name not in codecs:
+        raise Exception(f"Unknown encoder profile {name}, choose from {', '.join(codecs)}")
+    profile = {**PROFILE_DEFAULTS, **codecs[name], "name": name}
+    if profile["codec"] == "libx264" and not profile["pixel_format"]:
+        profile["pixel_format"] = "yuv420p"
+    return profile
+
+
+def get_profile(name=None):
+    """
+    Full settings of an encoder profile, with the calibrated overrides applied
+    when they were measured for this profile.
+    """
+    name = name or get_default_profile_name()
+    profile = get_base_profile(name)
+    defaults = load_encoder_defaults()
+    if defaults.get("profile") == name:
+        profile.update(defaults.get("settings", {}))
+    return profile
+
+
+def resolve_threads(profile, encoders=1):
+    """
+    Encoder threads for one of encoders running side by side, "auto" shares
+    every core between them.
+    """
+    threads = profile.get("threads", "auto")
+    if threads in (None, "auto"):
+        return max(1, (os.cpu_count() or 1) // max(1, encoders))
+    return int(threads)
+
+
+def get_video_args(profile):
+    """
+    Video encoder arguments, thread count excluded since it depends on how
+    many encoders run at once.
+    """
+    args = ["-c:v", profile["codec"]]
+    if profile.get("preset"):
+        args += ["-preset", profile["preset"]]
+    if profile.get("crf") is not None:
+        args += ["-crf", str(profile["crf"])]
+    if profile.get("pixel_format"):
+        args += ["-pix_fmt", profile["pixel_format"]]
+    if profile.get("keyframe_interval"):
+        args += ["-g", str(profile["keyframe_interval"])]
+    return args
+
+
+def get_audio_args(profile):
+    args = ["-c:a", profile["audio_codec"]]
+    if profile.get("audio_bitrate"):
+        args += ["-b:a", str(profile["audio_bitrate"])]
+    return args
+
+
+def get_moviepy_args(profile):
+    """
+    Keyword arguments for VideoClip.write_videofile.
+    """
+    ffmpeg_params = []
+    if profile.get("crf") is not None:
+        ffmpeg_params += ["-crf", str(profile["crf"])]
+    if profile.get("keyframe_interval"):
+        ffmpeg_params += ["-g", str(profile["keyframe_interval"])]
+    return {
+        "codec": profile["codec"],
+        "audio_codec": profile["audio_codec"],
+        "preset": profile.get("preset") or "medium",
+        "audio_bitrate": profile.get("audio_bitrate"),
+        "threads": resolve_threads(profile),
+        "ffmpeg_params": ffmpeg_params or None,
+    }
+
+
+def time_encode(profile, threads, seconds, size=CALIBRATE_SIZE, fps=CALIBRATE_FPS):
+    """
+    Encode seconds of ffmpeg's moving test pattern, returns the time taken and
+    the output size in bytes.
+    """
+    from frame_store import get_ffmpeg_binary
+
+    fd, out_file = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    command = [
+        get_ffmpeg_binary(),
+        "-y",
+        "-loglevel", "error",
+        "-f", "lavfi",
+        "-i", f"testsrc2=size={size}:rate={fps}",
+        "-t", str(seconds),
+        "-an",
+        *get_video_args(profile),
+        "-threads", str(threads),
+        out_file,
+    ]
+    try:
+        start = time.perf_counter()
+        subprocess.run(command, check=True)
+        elapsed = time.perf_counter() - start
+        return elapsed, os.path.getsize(out_file)
+    finally:
+        os.remove(out_file)
+
+
+def calibrate(name=None, seconds=4, presets=CALIBRATE_PRESETS):
+    """
+    Try every preset at the profile's CRF on all cores, keep the one with the
+    smallest time x size product, then find the fastest thread count for it.
+    Returns the settings and the measurements.
+    """
+    profile = get_base_profile(name or get_default_profile_name())
+    cores = os.cpu_count() or 1
+    measurements = []
+    for preset in presets:
+        elapsed, size = time_encode({**profile, "preset": preset}, cores, seconds)
+        measurements.append({"preset": preset, "threads": cores, "seconds": elapsed, "bytes": size})
+        print(f"{preset:<12}{cores:>4} threads{elapsed:>8.2f}s{size / 1024:>10.0f} KiB")
+    fastest = min(m["seconds"] for m in measurements)
+    smallest = min(m["bytes"] for m in measurements)
+    best = min(
+        measurements,
+        key=lambda m: (m["seconds"] / fastest) * (m["bytes"] / smallest),
+    )
+    thread_counts = sorted({cores, max(1, cores // 2), max(1, cores // 4)}, reverse=True)
+    thread_times = {cores: best["seconds"]}
+    for threads in thread_counts[1:]:
+        elapsed, size = time_encode({**profile, "preset": best["preset"]}, threads, seconds)
+        thread_times[threads] = elapsed
+        measurements.append({"preset": best["preset"], "threads": threads, "seconds": elapsed, "bytes": size})
+        print(f"{best['preset']:<12}{threads:>4} threads{elapsed:>8.2f}s{size / 1024:>10.0f} KiB")
+    threads = min(thread_times, key=thread_times.get)
+    settings = {"preset": best["preset"], "threads": "auto" if threads == cores else threads}
+    return settings, measurements
+
+
+def save_encoder_defaults(name, settings, measurements, path=ENCODER_DEFAULTS_PATH):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "profile": name,
+                "settings": settings,
+                "cpu_count": os.cpu_count(),
+                "calibrated": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "measurements": measurements,
+            },
+            f,
+            indent=4,
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("list", "show", "calibrate"):
+        print(f"Usage: python {sys.argv[0]} list")
+        print(f"       python {sys.argv[0]} show [<profile>]")
+        print(f"       python {sys.argv[0]} calibrate [<profile>] [<seconds>]")
+        sys.exit(1)
+
+    if sys.argv[1] == "list":
+        default = get_default_profile_name()
+        for name in codecs:
+            profile = get_profile(name)
+            print(
+                f"{'*' if name == default else ' '} {name:<10}{profile['codec']:<10}{profile['audio_codec']:<12}"
+                f"preset={profile['preset']} crf={profile['crf']} threads={profile['threads']}"
+            )
+    elif sys.argv[1] == "show":
+        profile = get_profile(sys.argv[2] if len(sys.argv) > 2 else None)
+        print(json.dumps(profile, indent=4))
+        print("Video:", " ".join(get_video_args(profile)), "-threads", resolve_threads(profile))
+        print("Audio:", " ".join(get_audio_args(profile)))
+    else:
+        name = sys.argv[2] if len(sys.argv) > 2 else get_default_profile_name()
+        seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 4
+        print(f"Calibrating {name} on {os.cpu_count()} cores with {seconds:g}s of {CALIBRATE_SIZE} video")
+        settings, measurements = calibrate(name, seconds)
+        save_encoder_defaults(name, settings, measurements)
+        print(f"Default is now {name} with {settings}, saved to {ENCODER_DEFAULTS_PATH}")
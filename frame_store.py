@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy
+
+from tracing import span
+
+CACHE_FOLDER = "cache"
+STORE_FOLDER = os.path.join(CACHE_FOLDER, "frames")
+STORE_VERSION = 2
+STALE_SECONDS = 3600  # Unreferenced data files untouched this long are left over from other builds
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+
+def get_ffmpeg_binary():
+    from moviepy.config import get_setting
+
+    return get_setting("FFMPEG_BINARY")
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def mapping_fingerprint(mapping):
+    data = json.dumps(mapping, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def mapping_to_seconds(mapping, sample_rate):
+    start = mapping["start"] / sample_rate
+    return start, start + mapping["length"] / sample_rate
+
+
+def decode_span(video_path, start, end, output_args, unit_size, f, limit=None, units_per_read=1):
+    """
+    Decode [start, end) of video_path with ffmpeg and write whole units (a
+    frame or a sample frame) of the raw output to f, stopping after limit units.
+    Returns the number of units written.
+    """
+    command = [
+        get_ffmpeg_binary(),
+        "-loglevel", "error",
+        "-ss", f"{start:.6f}",
+        "-i", video_path,
+        "-t", f"{end - start:.6f}",
+        *output_args,
+        "-",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    count = 0
+    pending = b""
+    try:
+        while limit is None or count < limit:
+            chunk = process.stdout.read(unit_size * units_per_read)
+            if not chunk:
+                break
+            data = pending + chunk
+            units = len(data) // unit_size
+            if limit is not None:
+                units = min(units, limit - count)
+            f.write(data[: units * unit_size])
+            pending = data[units * unit_size :]
+            count += units
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+    return count
+
+
+def build_frame_store(video_path, mapping, store_path, sample_rate=SAMPLE_RATE):
+    """
+    Decode every mapped note span of video_path once into raw rgb24 frames and
+    float32 stereo PCM, laid out back to back so they can be memory mapped.
+    Every build writes data files under new names and then swaps in the
+    index naming them, so concurrent builders and readers never see a partial
+    store or pair an index with another build's data.
+    """
+    with span("build_frame_store", "decode", video=video_path):
+        return _build_frame_store(video_path, mapping, store_path, sample_rate)
+
+
+def _build_frame_store(video_path, mapping, store_path, sample_rate):
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos(video_path)
+    width, height = infos["video_size"]
+    fps = infos["video_fps"]
+    frame_bytes = width * height * 3
+    sample_bytes = 4 * CHANNELS
+
+    os.makedirs(store_path, exist_ok=True)
+    index = {
+        "version": STORE_VERSION,
+        "source": file_fingerprint(video_path),
+        "mapping": mapping_fingerprint(mapping),
+        "size": [width, height],
+        "fps": fps,
+        "sample_rate": sample_rate,
+        "notes": {},
+    }
+    frame_offset = sample_offset = 0
+    video_args = ["-an", "-f", "rawvideo", "-pix_fmt", "rgb24"]
+    audio_args = ["-vn", "-f", "f32le", "-ac", str(CHANNELS), "-ar", str(sample_rate)]
+    paths = {
+        "frames": get_temp_path(store_path, "frames.", ".u8"),
+        "audio": get_temp_path(store_path, "audio.", ".f32"),
+        "index": get_temp_path(store_path, "index.", ".partial"),
+    }
+    index["files"] = {"frames": os.path.basename(paths["frames"]), "audio": os.path.basename(paths["audio"])}
+    swapped = False
+    try:
+        with open(paths["frames"], "wb") as frames_file, open(paths["audio"], "wb") as audio_file:
+            frame_offset, sample_offset = decode_notes(
+                video_path, mapping, sample_rate, index, frame_bytes, sample_bytes,
+                video_args, audio_args, frames_file, audio_file,
+            )
+        index["frame_count"] = frame_offset
+        index["sample_count"] = sample_offset
+        with open(paths["index"], "w") as f:
+            json.dump(index, f, indent=4)
+        previous = get_store_files(store_path)
+        os.replace(paths["index"], os.path.join(store_path, "index.json"))
+        swapped = True
+    finally:
+        for name, path in paths.items():
+            if not swapped or name == "index":
+                remove_quietly(path)
+    # Readers that opened the old index keep their mappings where the OS allows
+    for name in previous.values():
+        remove_quietly(os.path.join(store_path, name))
+    remove_stale_files(store_path, index["files"].values())
+    return index
+
+
+def get_temp_path(store_path, prefix, suffix):
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=store_path)
+    os.close(fd)
+    return path
+
+
+def get_store_files(store_path):
+    """
+    Data file names the current index of store_path points to, stores from
+    before versioned names used fixed ones.
+    """
+    try:
+        with open(os.path.join(store_path, "index.json"), "r") as f:
+            return json.load(f).get("files", {"frames": "frames.u8", "audio": "audio.f32"})
+    except (OSError, ValueError):
+        return {}
+
+
+def remove_stale_files(store_path, keep):
+    """
+    Data files of builds that were replaced at the same time or crashed.
+    Files of builds still running are recent, so they are kept.
+    """
+    now = time.time()
+    for name in os.listdir(store_path):
+        path = os.path.join(store_path, name)
+        try:
+            if name not in keep and name != "index.json" and now - os.path.getmtime(path) > STALE_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def decode_notes(video_path, mapping, sample_rate, index, frame_bytes, sample_bytes, video_args, audio_args, frames_file, audio_file):
+    """
+    Decode every note span into the open files, filling index["notes"].
+    Returns the total frame and sample counts.
+    """
+    frame_offset = sample_offset = 0
+    for note, note_mapping in mapping.items():
+        start, end = mapping_to_seconds(note_mapping, sample_rate)
+        with span("decode_frames", "decode", note=note):
+            frame_count = decode_span(
+                video_path, start, end, video_args, frame_bytes, frames_file
+            )
+        if not frame_count:
+            raise Exception(f"Could not decode frames for note {note} from {video_path}")
+        sample_count = int(round((end - start) * sample_rate))
+        with span("decode_audio", "decode", note=note):
+            written = decode_span(
+                video_path,
+                start,
+                end,
+                audio_args,
+                sample_bytes,
+                audio_file,
+                limit=sample_count,
+                units_per_read=4096,
+            )
+        # Pad so the PCM span matches the mapping exactly
+        if written < sample_count:
+            audio_file.write(bytes((sample_count - written) * sample_bytes))
+        index["notes"][note] = {
+            "start": start,
+            "end": end,
+            "frame_offset": frame_offset,
+            "frame_count": frame_count,
+            "sample_offset": sample_offset,
+            "sample_count": sample_count,
+        }
+        frame_offset += frame_count
+        sample_offset += sample_count
+    return frame_offset, sample_offset
+
+
+class FrameStore:
+    """
+    Read only view over a store written by build_frame_store. Arrays are
+    numpy memmaps so they can be shared by threads, and by processes that open
+    the same store_path, without copying.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        for attempt in range(3):
+            try:
+                self.open()
+                return
+            except FileNotFoundError:
+                # A rebuild removed the data files of the index just read
+                if attempt == 2:
+                    raise
+
+    def open(self):
+        store_path = self.store_path
+        with open(os.path.join(store_path, "index.json"), "r") as f:
+            self.index = json.load(f)
+        files = self.index["files"]
+        self.size = tuple(self.index["size"])
+        self.fps = self.index["fps"]
+        self.sample_rate = self.index["sample_rate"]
+        self.notes = self.index["notes"]
+        width, height = self.size
+        self.frame_array = numpy.memmap(
+            os.path.join(store_path, files["frames"]),
+            dtype=numpy.uint8,
+            mode="r",
+            shape=(self.index["frame_count"], height, width, 3),
+        ) if self.index["frame_count"] else numpy.zeros((0, height, width, 3), numpy.uint8)
+        self.audio_array = numpy.memmap(
+            os.path.join(store_path, files["audio"]),
+            dtype=numpy.float32,
+            mode="r",
+            shape=(self.index["sample_count"], CHANNELS),
+        ) if self.index["sample_count"] else numpy.zeros((0, CHANNELS), numpy.float32)
+
+    def duration(self, note):
+        info = self.notes[note]
+        return info["end"] - info["start"]
+
+    def frames(self, note):
+        info = self.notes[note]
+        offset = info["frame_offset"]
+        return self.frame_array[offset : offset + info["frame_count"]]
+
+    def audio(self, note):
+        info = self.notes[note]
+        offset = info["sample_offset"]
+        return self.audio_array[offset : offset + info["sample_count"]]
+
+    def note_clip(self, note):
+        """
+        Equivalent of VideoFileClip.subclip over the note's span.
+        """
+        from moviepy.audio.AudioClip import AudioArrayClip
+        from moviepy.video.VideoClip import VideoClip
+
+        frames = self.frames(note)
+        fps = self.fps
+        last = len(frames) - 1
+
+        def make_frame(t):
+            return frames[max(0, min(int(t * fps + 1e-6), last))]
+
+        clip = VideoClip(make_frame, duration=self.duration(note))
+        clip.fps = fps
+        clip.audio = AudioArrayClip(numpy.asarray(self.audio(note)), fps=self.sample_rate)
+        return clip
+
+
+def is_store_valid(store_path, video_path, mapping):
+    try:
+        with open(os.path.join(store_path, "index.json"), "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (
+        index.get("version") == STORE_VERSION
+        and index.get("source") == file_fingerprint(video_path)
+        and index.get("mapping") == mapping_fingerprint(mapping)
+    )
+
+
+def get_store_path(video_path):
+    """
+    Stores are named after the video and a hash of its full path, so videos
+    with the same name in different folders get their own store.
+    """
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    key = hashlib.sha1(os.path.abspath(video_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(STORE_FOLDER, f"{name}_{key}")
+
+
+def open_frame_store(video_path, mapping, sample_rate=SAMPLE_RATE, store_path=None):
+    """
+    Open the frame store for video_path, decoding it first if it is missing or
+    out of date with the video or its mapping.
+    """
+    store_path = store_path or get_store_path(video_path)
+    if not is_store_valid(store_path, video_path, mapping):
+        print(f"Building frame store for {video_path}")
+        build_frame_store(video_path, mapping, store_path, sample_rate)
+    return FrameStore(store_path)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+import numpy
+from tqdm import tqdm
+
+from audio_render import render_store_audio
+from encoder_profiles import get_video_args
+from frame_store import CACHE_FOLDER
+from notes import get_note_starts
+from pipe_renderer import FILL_COLOR, compile_timeline, write_audio_file, write_frames
+from pitch_cache import add_written, evict
+from pitch_resolver import resolve_notes
+from segment_concat import concat_segments
+from tracing import count, span
+
+SEGMENT_CACHE_FOLDER = os.path.join(CACHE_FOLDER, "segments")
+SEGMENT_CACHE_MB = float(os.environ.get("SEGMENT_CACHE_MB", "4096"))
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", "4"))
+SEGMENT_VERSION = 1
+
+
+def get_segment_bounds(notes, fps, frame_count, segment_seconds=SEGMENT_SECONDS):
+    """
+    Cut the timeline at the first note starting after every segment_seconds,
+    so an edit only moves the cuts after it and segments always begin on a note.
+    """
+    starts, _ = get_note_starts(notes)
+    note_frames = numpy.unique(numpy.ceil(starts * fps - 1e-9).astype(numpy.int64))
+    targets = numpy.arange(1, int(frame_count / fps // segment_seconds) + 1) * segment_seconds * fps
+    positions = numpy.searchsorted(note_frames, targets - 1e-6)
+    cuts = note_frames[positions[positions < len(note_frames)]]
+    edges = sorted(set([0, *[int(cut) for cut in cuts if 0 < cut < frame_count], frame_count]))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def get_render_key(store, codec):
+    """
+    Everything besides the frame indices that changes the encoded pixels.
+    """
+    return json.dumps(
+        {
+            "version": SEGMENT_VERSION,
+            "source": store.index["source"],
+            "mapping": store.index["mapping"],
+            "size": list(store.size),
+            "fps": store.fps,
+            "encoder": get_video_args(codec),
+            "fill": FILL_COLOR,
+        },
+        sort_keys=True,
+    ).encode("utf-8")
+
+
+def get_segment_key(render_key, frame_indices):
+    digest = hashlib.sha1(render_key)
+    digest.update(numpy.ascontiguousarray(frame_indices, numpy.int64).data)
+    return digest.hexdigest()
+
+
+def get_segment_path(key, cache_folder=SEGMENT_CACHE_FOLDER):
+    return os.path.join(cache_folder, key[:2], f"{key}.mp4")
+
+
+def encode_segment(store, frame_indices, codec, path):
+    """
+    Encode one segment into the cache, renamed into place only once complete.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=".mp4", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        write_frames(temp_path, store, frame_indices, codec, threads=1, progress=False)
+        os.replace(temp_path, path)
+        add_written(os.path.getsize(path), SEGMENT_CACHE_FOLDER, ".mp4")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def render_song_incremental(out_file, store, mapping_data, notes, codec, shifted=None, workers=None):
+    """
+    Render through a cache of encoded segments. Only segments whose frames
+    changed since an earlier render are encoded, the rest are stream copied.
+    """
+    resolved = resolve_notes(mapping_data, notes)
+    frame_indices = compile_timeline(store, resolved, notes)
+    bounds = get_segment_bounds(notes, store.fps, len(frame_indices))
+    render_key = get_render_key(store, codec)
+    paths = []
+    missing = {}
+    for start, end in bounds:
+        path = get_segment_path(get_segment_key(render_key, frame_indices[start:end]))
+        paths.append(path)
+        if os.path.isfile(path):
+            os.utime(path)  # Mark as recently used
+        else:
+            missing[path] = (start, end)
+    print(f"Segments: {len(bounds) - len(missing)} reused, {len(missing)} to render")
+    count("segments.reused", len(bounds) - len(missing))
+    count("segments.rendered", len(missing))
+
+    def encode(item):
+        path, (start, end) = item
+        with span("encode_segment", "encode", frames=end - start):
+            encode_segment(store, frame_indices[start:end], codec, path)
+
+    audio_path = write_audio_file(render_store_audio(store, resolved, notes, shifted=shifted))
+    try:
+        with ThreadPool(workers or os.cpu_count()) as pool:
+            for _ in tqdm(pool.imap_unordered(encode, missing.items()), desc="Segments", total=len(missing)):
+                pass
+        concat_segments(out_file, paths, audio_path, store.sample_rate, codec)
+    finally:
+        os.remove(audio_path)
+    evict(SEGMENT_CACHE_MB, SEGMENT_CACHE_FOLDER, ".mp4")
+    return len(frame_indices) / store.fps
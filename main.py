@@ -1,101 +1,82 @@
+import importlib
 import json
+import math
 import os
-import re
+import sys
 from functools import partial
-from multiprocessing.pool import ThreadPool
-from sys import argv
 from threading import local
 
-import librosa
-import moviepy.editor as mp
-import numpy
-from moviepy.audio.AudioClip import AudioArrayClip
-from moviepy.editor import ColorClip
-from moviepy.video.io.VideoFileClip import VideoFileClip
-from proglog import TqdmProgressBarLogger
-from tqdm import tqdm
+from tracing import count, finish, print_peak_memory, span
 
-from consts import codecs
+# moviepy, librosa and friends are imported where they are used so that
+# commands that only read songs and mappings, like plan, start instantly
+FRAME_STORE = os.environ.get("FRAME_STORE", "true").lower() == "true"
+RENDER_ENGINE = os.environ.get("RENDER_ENGINE", "moviepy").lower()
+# Open the result in the default player once rendered, Windows only
+OPEN_OUTPUT = os.environ.get("OPEN_OUTPUT", "true").lower() == "true"
+MAPPING_SAMPLE_RATE = 48000
+DEFAULT_FPS = 30
+# Rough throughput used by plan to estimate render time
+PLAN_ENCODE_FPS = float(os.environ.get("PLAN_ENCODE_FPS", "200"))
+PLAN_SHIFT_SPEED = float(os.environ.get("PLAN_SHIFT_SPEED", "10"))
+_moviepy_logger = None
 
-MOVIEPY_LOGGER = TqdmProgressBarLogger(print_messages=False)
-CACHING = os.environ.get("CACHING", "false").lower() == "true"
-CODEC = "mp4_alt"
-shift_cache = {}
 
+def get_moviepy_logger():
+    global _moviepy_logger
+    if _moviepy_logger is None:
+        from proglog import TqdmProgressBarLogger
 
-def sample_to_seconds(sample, sample_rate):
-    return sample / sample_rate
+        _moviepy_logger = TqdmProgressBarLogger(print_messages=False)
+    return _moviepy_logger
 
 
-def mapping_to_timestamps(mapping, sample_rate):
-    start = mapping["start"]
-    end = mapping["length"] + start
-    return sample_to_seconds(start, sample_rate), sample_to_seconds(end, sample_rate)
+def get_source_clip(input_video, mapping_data, note, sample_rate):
+    from frame_store import FrameStore
+    from notes import mapping_to_timestamps
+
+    if isinstance(input_video, FrameStore):
+        return input_video.note_clip(note)
+    start, end = mapping_to_timestamps(mapping_data[note], sample_rate)
+    return input_video.subclip(start, end)
 
 
 def get_note_video(
-    mapping_data, note_data, input_video: VideoFileClip, sample_rate=48000
+    mapping_data,
+    note_data,
+    input_video,
+    sample_rate=48000,
+    with_audio=True,
+    resolution=None,
 ):
-    note, note_duration = note_data["note"], note_data["duration"]
-    ###
-    find_note = mapping_data.get(note, None)
-    shift_amount = 0
-    if find_note is None:
-        # Have to pitch shift
-        found = re.findall(r"([A-G][#]?) ?([0-9]{0,2})", note)
-        if not found:
-            raise Exception(f"Could not find note: {note}")
-        found = found[0]
-        note_ = found[0].strip()
-        octave = int(found[1].strip()) if found[1].strip() else 1
-        find_note_up = find_note_down = None
-        make_note_up = make_note_down = None
-        i = 1
-        while find_note_up is None and find_note_down is None:
-            # shift_up = (octave+i)%10
-            # if shift_up == 0:
-            #     shift_up = 1
-            # shift_down = (octave-i)%10
-            # if shift_down == 0:
-            #     shift_down = 9
-            # Need to rework shift because rotations are not allowed
-            shift_up = octave + i
-            shift_down = octave - i
-
-            make_note_up = f"{note_}{shift_up}" if shift_up != 1 else note_
-            make_note_down = f"{note_}{shift_down}" if shift_down != 1 else note_
-            find_note_up = mapping_data.get(make_note_up, None)
-            find_note_down = mapping_data.get(make_note_down, None)
-            i += 1
-        if find_note_up:
-            shift_amount = (-i) + 1
-            find_note = make_note_up
-        elif find_note_down:
-            shift_amount = i - 1
-            find_note = make_note_down
-        else:
-            raise Exception(f"Could not find base for note {note}")
+    with span("note", "note", note=note_data["note"], duration=note_data["duration"]):
+        return _get_note_video(
+            mapping_data, note_data, input_video, sample_rate, with_audio, resolution
+        )
 
+
+def _get_note_video(
+    mapping_data, note_data, input_video, sample_rate, with_audio, resolution
+):
+    import moviepy.editor as mp
+    from moviepy.editor import ColorClip
+
+    from pitch_resolver import PitchResolver
+    from transformations import shift_pitch
+
+    note, note_duration = note_data["note"], note_data["duration"]
+    if note:
+        if resolution is None:
+            resolution = PitchResolver(mapping_data).resolve_name(note)
+        find_note, shift_amount = resolution  # Shift in semitones
     else:
-        find_note = note
-    ###
-    start, end = mapping_to_timestamps(mapping_data[find_note], sample_rate)
-    note_video: VideoFileClip
-    if (
-        CACHING
-    ):  # If caching is enabled then caching is done on the whole video, else it is done on the note clip
-        if shift_amount:
-            if shift_cache.get(find_note, {}).get(shift_amount, None) is None:
-                note_video = input_video.subclip(start, end)
-                shift_cache[find_note] = {}
-                shift_cache[find_note][shift_amount] = shift_pitch(
-                    note_video, shift_amount
-                )
-            note_video = shift_cache[find_note][shift_amount]
-        else:
-            note_video = input_video.subclip(start, end)
-    else:
-        note_video = input_video.subclip(start, end)
+        # Blank note at the start of the song, use any note for the empty clip
+        find_note, shift_amount = next(iter(mapping_data)), 0
+    if not with_audio:
+        # Audio comes from the song's master buffer instead
+        shift_amount = 0
+    # Shifted audio is cached by the persistent pitch cache, not here
+    note_video = get_source_clip(input_video, mapping_data, find_note, sample_rate)
 
     # video_duration = end - start
     video_duration = note_video.duration
@@ -107,19 +88,20 @@ def get_note_video(
         end = start
     if video_duration < note_duration:
         # Add green screen fill
-        black_fill = ColorClip(
-            size=input_video.size,
-            color=(0, 255, 0),
-            duration=note_duration - video_duration,
-        )
-        black_fill.set_fps(input_video.fps)
+        count("pad_clips")
+        with span("pad", "note"):
+            black_fill = ColorClip(
+                size=input_video.size,
+                color=(0, 255, 0),
+                duration=note_duration - video_duration,
+            )
+            black_fill.set_fps(input_video.fps)
         end = start + video_duration
     else:
         end = start + note_duration
 
     video = note_video.subclip(start, end)
-    if not CACHING:
-        video = shift_pitch(video, shift_amount) if shift_amount else video
+    video = shift_pitch(video, shift_amount) if shift_amount else video
     # video = input_video.subclip(start, end)
     # video = shift_pitch(video, shift_amount) if shift_amount else video
     # Can't cache video clips because the duration changes
@@ -133,140 +115,309 @@ def get_note_video(
 
     #     # video = shift_pitch(video, shift_amount)
 
+    if not with_audio:
+        video = video.without_audio()
     if black_fill:
         video = mp.concatenate_videoclips([video, black_fill])
     return video
 
 
-def parse_notes(path):
-    with open(path, "r", encoding="utf-8") as f:
-        data = f.read().replace("-", ",").replace("–", ",")
-    tempo, notes = data.split("\n", 1)
-    tempo = tempo.split(" ")
-    if not tempo:
-        raise Exception("Could not find tempo information")
-    bpm = int(tempo[0].strip())
-    if len(tempo) == 1:  # Compatibility
-        beat_size = 4.0
-    else:
-        beat_size = float(tempo[1].strip())
-    bps = bpm / 60 * beat_size
-    notes_data = []
-    for line in notes.split("\n"):
-        notes_data += [n.strip().upper() for n in line.split(",")]
-    note_duration = 1 / bps
-    all_notes = {}
-    last_note = 0
-    for note in notes_data:
-        if not note:
-            if not last_note:
-                last_note += 1
-                all_notes[last_note - 1] = {"note": "", "duration": note_duration}
-                continue
-            all_notes[last_note - 1]["duration"] += note_duration
-            continue
-        all_notes[last_note] = {"note": note, "duration": note_duration}
-        last_note += 1
-    return bpm, beat_size, all_notes
+shared_local = local()
 
 
-FFMPEG_BINARY_AAC = "ffmpeg.exe"
-OUTPUT_FOLDER = "output"
-SONGS_FOLDER = "songs"
-DATA_FOLDER = "input"
+def process_note(mappings, notes, resolved, video_path, input_video, note):
+    if FRAME_STORE:
+        return get_note_video(
+            mappings,
+            notes[note],
+            input_video,
+            input_video.sample_rate,
+            False,
+            resolved[note],
+        )
+    if not hasattr(shared_local, "video") or not shared_local.video:
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+
+        shared_local.video = in_video = VideoFileClip(video_path)
+        shared_local.video.audio = in_video.audio.set_fps(48000)  # type: ignore
+        shared_local.sample_rate = shared_local.video.audio.fps  # type: ignore
 
-if len(argv) < 3:
-    print(f"Usage: python {argv[0]} <input_name> <song_name>")
-    exit()
+    return get_note_video(
+        mappings,
+        notes[note],
+        shared_local.video,
+        shared_local.sample_rate,
+        False,
+        resolved[note],
+    )
 
-input_video_path = os.path.join(DATA_FOLDER, f"{argv[1]}.mp4")
-input_notes_path = os.path.join(SONGS_FOLDER, f"{argv[2]}.txt")
-mappings_path = os.path.join(DATA_FOLDER, f"{argv[1]}.json")
 
-with open(mappings_path, "r") as f:
-    mappings = json.load(f)
+ENGINES = {
+    "pipe": ("pipe_renderer", "render_song"),
+    "concat": ("segment_concat", "render_song_concat"),
+    "chunked": ("chunked_render", "render_song_chunked"),
+    "incremental": ("incremental", "render_song_incremental"),
+    # Bounded memory for very long songs
+    "stream": ("streaming", "render_song_streaming"),
+}
 
-bpm, beat_size, notes = parse_notes(input_notes_path)
+FFMPEG_BINARY_AAC = "ffmpeg.exe"
+OUTPUT_FOLDER = "output"
+SONGS_FOLDER = "songs"
+DATA_FOLDER = "input"
 
 
-input_video = VideoFileClip(input_video_path)
-# Test Change Pitch
-def shift_pitch_audio(audio_array, octaves):
-    audio_left = audio_array[:, 0]
-    audio_right = audio_array[:, 1]
-    y_shifted_l = librosa.effects.pitch_shift(audio_left, 48000, n_steps=octaves * 12)
-    y_shifted_r = librosa.effects.pitch_shift(audio_right, 48000, n_steps=octaves * 12)
-    # Create stereo audio
-    y_shifted = numpy.stack((y_shifted_l, y_shifted_r), axis=1)
-    return y_shifted
+def get_engine(name):
+    module, function = ENGINES[name]
+    return getattr(importlib.import_module(module), function)
+
+
+def load_mapping(actor):
+    with open(os.path.join(DATA_FOLDER, f"{actor}.json"), "r") as f:
+        return json.load(f)
+
+
+def load_song(song_name, track=None):
+    """
+    Returns bpm, beat size and notes of songs/<song_name>, preferring the
+    binary event file over the text one.
+    """
+    from notes import parse_notes
+    from song_events import events_to_notes, load_events
+
+    events_path = os.path.join(SONGS_FOLDER, f"{song_name}.npz")
+    if os.path.isfile(events_path):
+        events, meta = load_events(events_path)
+        notes = events_to_notes(events, meta, track)
+        return int(round(meta["bpm"])), meta.get("beat_size", 4.0), notes
+    return parse_notes(os.path.join(SONGS_FOLDER, f"{song_name}.txt"))
+
+
+def get_track_name(song_name, track=None):
+    """
+    Name of a track as written in output file names, so a track given by
+    index and by name, or as 0 and "0", gets the same file.
+    """
+    from midi_convertor import get_safe_name
+    from song_events import get_track_index, load_events
+
+    if track is None:
+        return None
+    events_path = os.path.join(SONGS_FOLDER, f"{song_name}.npz")
+    if os.path.isfile(events_path):
+        _, meta = load_events(events_path)
+        track = meta["tracks"][get_track_index(meta, track)]
+    return get_safe_name(str(track))
+
+
+def get_output_file(actor, song_name, bpm, beat_size, draft=False, track=None):
+    output_path_folder = os.path.join(OUTPUT_FOLDER, actor.strip())
+    os.makedirs(output_path_folder, exist_ok=True)
+    # Tracks of the same song must not overwrite each other
+    track_name = get_track_name(song_name, track)
+    suffix = (f"_{track_name}" if track_name is not None else "") + ("_draft" if draft else "")
+    return os.path.normpath(
+        os.path.join(output_path_folder, f"{song_name}_{bpm}_{beat_size}_{actor}{suffix}.mp4")
+    )
 
 
-def shift_pitch(clip, octaves):
-    audio = clip.audio.set_fps(48000)
-    audio_array = audio.to_soundarray()
-    y_shifted = shift_pitch_audio(audio_array, octaves)
-    # Create AudioClip from numpy array
-    audio_shifted = AudioArrayClip(y_shifted, fps=48000).set_fps(48000)
-    clip.audio = audio_shifted
-    return clip
+def get_input_video_path(actor, draft=False):
+    input_video_path = os.path.join(DATA_FOLDER, f"{actor}.mp4")
+    if draft:
+        from proxy import get_proxy
 
+        return get_proxy(input_video_path)
+    return input_video_path
 
-# input_video.audio = audio = input_video.audio.set_fps(48000) # type: ignore
-# sample_rate = audio.fps
 
-output_path = f"{argv[2]}_{bpm}_{beat_size}_{argv[1]}.mp4"
+def render(actor, song_name, track=None):
+    from multiprocessing.pool import ThreadPool
 
-print(
-    f"Task -> Actor: {argv[1].strip().title()} | Song: {argv[2].replace('_', ' ').strip().title()} | BPM: {bpm} | Beats: {beat_size} ({beat_size//4}/4) | {len(notes)} notes"
-)
-# print("Sample Rate:", sample_rate)
+    import moviepy.editor as mp
+    from moviepy.audio.AudioClip import AudioArrayClip
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    from tqdm import tqdm
 
-shared_local = local()
+    from audio_render import (
+        load_actor_audio,
+        render_audio,
+        render_store_audio,
+        slice_note_audio,
+        write_wav,
+    )
+    from encoder_profiles import get_moviepy_args, get_profile
+    from frame_store import open_frame_store
+    from pitch_resolver import PitchResolver
+    from proxy import DRAFT, DRAFT_CODEC
+
+    codec = get_profile(DRAFT_CODEC if DRAFT else None)
+    input_video_path = get_input_video_path(actor, DRAFT)
+    mappings = load_mapping(actor)
+
+    with span("load_song"):
+        bpm, beat_size, notes = load_song(song_name, track)
+
+    with span("resolve"):
+        resolver = PitchResolver(mappings)
+        resolved = resolver.resolve(notes)
+        required_shifts = resolver.required_shifts(notes)
+
+    with span("open_video"):
+        if RENDER_ENGINE == "audio":
+            input_video = None
+        elif FRAME_STORE:
+            # Decoded once, shared zero-copy by every worker thread
+            input_video = open_frame_store(input_video_path, mappings)
+        else:
+            input_video = VideoFileClip(input_video_path)
+    # input_video.audio = audio = input_video.audio.set_fps(48000) # type: ignore
+    # sample_rate = audio.fps
 
-videos = []
-note = -1
+    print(
+        f"Task -> Actor: {actor.strip().title()} | Song: {song_name.replace('_', ' ').strip().title()} | BPM: {bpm} | Beats: {beat_size} ({beat_size//4}/4) | {len(notes)} notes"
+    )
+    print(
+        f"Pitch policy: {resolver.policy} | {sum(1 for _, shift in required_shifts if shift)} unique shifts"
+    )
+    # print("Sample Rate:", sample_rate)
+
+    out_file = get_output_file(actor, song_name, bpm, beat_size, DRAFT, track)
+    print(f"Encoder profile: {codec['name']}" + (f" | Draft from {input_video_path}" if DRAFT else ""))
+
+    if RENDER_ENGINE == "audio":
+        out_file = os.path.splitext(out_file)[0] + ".wav"
+        print(f"Saving to {out_file}")
+        audio = render_audio(
+            slice_note_audio(load_actor_audio(input_video_path), mappings),
+            resolved,
+            notes,
+        )
+        write_wav(out_file, audio)
+        print("Duration: {:.2f}".format(len(audio) / 48000))
+    elif RENDER_ENGINE in ENGINES:
+        store = input_video if FRAME_STORE else open_frame_store(input_video_path, mappings)
+        render_engine = get_engine(RENDER_ENGINE)
+        print(f"Saving to {out_file}")
+        with span(f"render_{RENDER_ENGINE}"):
+            duration = render_engine(out_file, store, mappings, notes, codec)
+        print("Duration: {:.2f}".format(duration))
+    else:
+        threads = os.cpu_count()
+        pool = ThreadPool(os.cpu_count())
+        print("Threads:", threads)
+        process_note_partial = partial(
+            process_note, mappings, notes, resolved, input_video_path, input_video
+        )
+        with span("notes"):
+            results = tqdm(
+                pool.imap(process_note_partial, range(len(notes))),
+                desc="Notes",
+                total=len(notes),
+            )
+            videos = list(results)
+
+        # videos = pool.map(process_note_partial, notes.keys())
+        # for note in tqdm(notes, desc="Notes"):
+        #     video = get_note_video(mappings, notes[note], input_video, sample_rate)
+        #     videos.append(video)
+
+        with span("concatenate"):
+            concat_clip = mp.concatenate_videoclips(videos)
+        with span("audio"):
+            if FRAME_STORE:
+                audio = render_store_audio(input_video, resolved, notes)
+            else:
+                audio = render_audio(
+                    slice_note_audio(load_actor_audio(input_video_path), mappings),
+                    resolved,
+                    notes,
+                )
+        concat_clip = concat_clip.set_audio(AudioArrayClip(audio, fps=48000))
+
+        print(f"Saving to {out_file}")
+        print("Duration: {:.2f}".format(concat_clip.duration))
+        with span("write_videofile", "encode"):
+            concat_clip.write_videofile(
+                out_file,
+                logger=get_moviepy_logger(),
+                **get_moviepy_args(codec),
+            )
+
+    print_peak_memory()
+    finish(os.path.splitext(out_file)[0] + "_trace.json")
+    if OPEN_OUTPUT and hasattr(os, "startfile"):
+        os.startfile(out_file)
+
+
+def get_store_fps(actor):
+    """
+    Frame rate recorded in the actor's frame store, if it has been built.
+    """
+    from frame_store import get_store_path
+
+    try:
+        with open(os.path.join(get_store_path(os.path.join(DATA_FOLDER, f"{actor}.mp4")), "index.json"), "r") as f:
+            return json.load(f)["fps"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def plan(actor, song_names, track=None):
+    """
+    Check songs against an actor mapping without touching any video. Returns
+    the number of songs with notes that cannot be resolved.
+    """
+    from pitch_resolver import PitchResolver
+
+    mappings = load_mapping(actor)
+    resolver = PitchResolver(mappings)
+    fps = get_store_fps(actor)
+    failed = 0
+    for song_name in song_names:
+        bpm, beat_size, notes = load_song(song_name, track)
+        missing = resolver.unresolved(notes)
+        print(f"{song_name}: {len(notes)} notes | {notes.duration:.2f}s | BPM: {bpm} | Beats: {beat_size}")
+        if missing:
+            failed += 1
+            print(f"  Unresolved notes: {', '.join(missing)}")
+            continue
+        required = resolver.required_shifts(notes)
+        histogram = {}
+        for (_, shift), note_count in required.items():
+            histogram[shift] = histogram.get(shift, 0) + note_count
+        print(
+            "  Shifts: "
+            + " ".join(f"{shift:+d}x{note_count}" for shift, note_count in sorted(histogram.items()))
+        )
+        # Every unique shift is computed once over the whole source note
+        shift_seconds = sum(
+            mappings[source]["length"] / MAPPING_SAMPLE_RATE
+            for source, shift in required
+            if shift
+        )
+        frames = math.ceil(notes.duration * (fps or DEFAULT_FPS))
+        estimate = frames / PLAN_ENCODE_FPS + shift_seconds / PLAN_SHIFT_SPEED
+        print(
+            f"  Cost: {frames} frames{'' if fps else f' (assuming {DEFAULT_FPS} fps)'}"
+            f" | {sum(1 for _, shift in required if shift)} unique shifts over {shift_seconds:.2f}s of audio"
+            f" | ~{estimate:.1f}s to render"
+        )
+    return failed
 
 
-def process_note(mappings, notes, video_path, note):
-    if not hasattr(shared_local, "video") or not shared_local.video:
-        shared_local.video = in_video = VideoFileClip(video_path)
-        shared_local.video.audio = in_video.audio.set_fps(48000)  # type: ignore
-        shared_local.sample_rate = shared_local.video.audio.fps  # type: ignore
+def main(argv):
+    if len(argv) > 1 and argv[1] == "plan":
+        if len(argv) < 4:
+            print(f"Usage: python {argv[0]} plan <input_name> <song_name> [<song_name> ...]")
+            return 1
+        return 1 if plan(argv[2], argv[3:]) else 0
+    if len(argv) < 3:
+        print(f"Usage: python {argv[0]} <input_name> <song_name> [<track>]")
+        print(f"       python {argv[0]} plan <input_name> <song_name> [<song_name> ...]")
+        return 1
+    render(argv[1], argv[2], argv[3] if len(argv) > 3 else None)
+    return 0
 
-    return get_note_video(
-        mappings, notes[note], shared_local.video, shared_local.sample_rate
-    )
 
-threads = os.cpu_count()
-pool = ThreadPool(os.cpu_count())
-print("Threads:", threads)
-process_note_partial = partial(process_note, mappings, notes, input_video_path)
-results = tqdm(
-    pool.imap(process_note_partial, notes.keys()), desc="Notes", total=len(notes)
-)
-videos = list(results)
-
-# videos = pool.map(process_note_partial, notes.keys())
-# for note in tqdm(notes, desc="Notes"):
-#     video = get_note_video(mappings, notes[note], input_video, sample_rate)
-#     videos.append(video)
-
-concat_clip = mp.concatenate_videoclips(videos)
-
-output_path_folder = os.path.join(OUTPUT_FOLDER, argv[1].strip())
-if not os.path.exists(output_path_folder):
-    os.makedirs(output_path_folder)
-out_file = os.path.join(output_path_folder, output_path).replace('/', '\\')
-
-
-print(f"Saving to {out_file}")
-print("Duration: {:.2f}".format(concat_clip.duration))
-concat_clip.write_videofile(
-    out_file,
-    codec=codecs[CODEC]["codec"],
-    audio_codec=codecs[CODEC]["audio_codec"],
-    logger=MOVIEPY_LOGGER,
-    threads=6,
-)
-
-os.startfile(out_file)
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
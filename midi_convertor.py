@@ -1,9 +1,14 @@
 import json
-from mido import MidiFile, bpm2tempo, tempo2bpm
+from mido import MidiFile
+import numpy
 import os
 import re
 import sys
 
+from song_events import make_events, save_events
+from tempo_map import TempoMap
+
+SONG_FORMAT = os.environ.get("SONG_FORMAT", "events").lower()
 NOTES_ALPHABET = "C C# D D# E F F# G G# A A# B".split()
 def note_idx_to_str(note: int):
     # Note 0 is C0
@@ -13,41 +18,65 @@ def note_idx_to_str(note: int):
     note_octave = note // 12
     return f"{note_letter}{note_octave}"
     
-def parse_midi_file(midi_path):
+def load_midi_file(midi_path):
     if not os.path.isfile(midi_path):
         midi_file, _ = os.path.splitext(midi_path)
         midi_file = f"midi/{midi_file}.mid"
-        midi = MidiFile(midi_file)
-    else:
-        midi = MidiFile(midi_path)
-    bpm: int = 0
-    note_length: int = 0
-    clocks: int = 0
-    numerator: int = 0
-    track_notes = {}
-    
+        return MidiFile(midi_file)
+    return MidiFile(midi_path)
+
+def get_midi(midi):
+    return midi if isinstance(midi, MidiFile) else load_midi_file(midi)
+
+def parse_midi_file(midi_path, verbose=False):
+    """
+    One pass over every track keeping only note messages, the tempo map and
+    the last time signature. midi_path can also be an already loaded MidiFile.
+    Note message times are rewritten to the ticks since the previous note at
+    the starting tempo, so later tempo changes keep their real length.
+    """
+    midi = get_midi(midi_path)
+    clocks: int = 24 # 4/4 until a time_signature says otherwise
+    numerator: int = 4
+    tempo_ticks, tempos = [], []
+    track_ticks = {}
+
     for i, track in enumerate(midi.tracks):
-        print('Track {}: {}'.format(i, track.name))
-        messages = []
+        notes, note_ticks = track_ticks.setdefault(track.name, ([], []))
+        ticks = 0
         for msg in track:
-            messages.append(msg.dict())
-            if msg.type == 'set_tempo':
-                bpm = tempo2bpm(msg.tempo)
-                print(f"BPM: {bpm}")
-                continue
-            if msg.type == 'time_signature':
+            ticks += msg.time
+            kind = msg.type
+            if kind == 'note_on' or kind == 'note_off':
+                notes.append(msg)
+                note_ticks.append(ticks)
+            elif kind == 'set_tempo':
+                tempo_ticks.append(ticks)
+                tempos.append(msg.tempo)
+            elif kind == 'time_signature':
                 clocks = msg.clocks_per_click
                 numerator = msg.numerator
-                note_length = clocks * numerator
-                print(f"Each note is {note_length} clocks long, consisting of {numerator} clicks of size {clocks} each")
-                continue
-            if msg.type == 'note_on' or msg.type == "note_off":
-                track_notes.setdefault(track.name, []).append(msg)
-        print(f"Track {i} has {len(messages)} messages")
-        # with open(f"debug/{midi_path}_track_{i}.json", "w", encoding='utf-8') as f:
-        #     json.dump(messages, f, ensure_ascii=False, indent=4)
+        if verbose:
+            print(f"Track {i}: {track.name} has {len(track)} messages")
+
+    tempo_map = TempoMap(tempo_ticks, tempos, midi.ticks_per_beat)
+    track_notes = {}
+    for name, (notes, note_ticks) in track_ticks.items():
+        if not notes:
+            continue
+        # Tracks sharing a name were merged, keep their notes in time order
+        order = numpy.argsort(note_ticks, kind="stable")
+        reference = tempo_map.to_reference_ticks(numpy.asarray(note_ticks)[order])
+        deltas = numpy.diff(reference, prepend=0).tolist()
+        track_notes[name] = [
+            msg if msg.time == delta else msg.copy(time=delta)
+            for msg, delta in zip((notes[i] for i in order), deltas)
+        ]
+    bpm = tempo_map.bpm
+    if verbose:
+        print(f"BPM: {bpm:g}" + (f" ({len(tempo_map) - 1} tempo changes)" if len(tempo_map) > 1 else ""))
+        print(f"Each note is {clocks * numerator} clocks long, consisting of {numerator} clicks of size {clocks} each")
 
-    # return int(bpm), int(note_length), track_notes, clocks
     return int(bpm), int(clocks), int(numerator), track_notes
 
 def get_separators(count, split_size):
@@ -68,7 +97,7 @@ def get_separators(count, split_size):
     return string
 
 def get_track_notes(track_messages, note_length, separator_size):
-    text_string = ""
+    text_parts = [] # Joined once at the end, repeated += is quadratic on long tracks
     last_note_type = None
     for note in track_messages:
         if note.type == "note_off":
@@ -83,7 +112,7 @@ def get_track_notes(track_messages, note_length, separator_size):
                 #     if len(text_string) > 1 and text_string[-2] in ",\n": # if there is a place for silence, add it
                 #         # Will never happen because if there is a place for silence, then seps will not be empty
                 #         text_string = text_string[:-1] + "X" + text_string[-1]
-            text_string += seps
+            text_parts.append(seps)
             last_note_type = "note_off"
             continue
         if note.type != "note_on":
@@ -99,11 +128,12 @@ def get_track_notes(track_messages, note_length, separator_size):
         if last_note_type == "note_on":
             separators -= 1
 
-        text_string += get_separators(separators, separator_size)
-        text_string += f"{note_idx_to_str(note.note)},"
+        text_parts.append(get_separators(separators, separator_size))
+        text_parts.append(f"{note_idx_to_str(note.note)},")
 
         last_note_type = "note_on"
         
+    text_string = "".join(text_parts)
     if text_string[0] == "\n": # Replace first newline with a comma
         text_string = "," + text_string[1:]
     return text_string
@@ -125,6 +155,121 @@ def normalize_note_octaves(notes): # TODO: Normalization should be segment based
 
     return notes
 
+
+def convert_track(track_messages, clock_size, numerator, separator_size_user=None, ticks_per_beat=None):
+    """
+    Convert the note messages of a track to the song notes format, returns the
+    beat size of the song header and the notes text. With ticks_per_beat the
+    beat size is the number of shortest notes in a beat, without it the
+    separator size is used as before.
+    """
+    if separator_size_user is not None:
+        beat_size = (numerator**2) / separator_size_user
+        separator_size = separator_size_user
+        lowest_clock = beat_size * clock_size
+    else:
+        times = {note.time for note in track_messages if note.time % clock_size == 0} # Get all times that are a multiple of the note length
+        times.discard(0) # Discord notes with no time
+        lowest_clock = min(times) # Multiple of clock_size
+
+        beat_size: float = (lowest_clock / clock_size)# Beats per clock 
+        separator_size = (numerator**2) / (beat_size)
+
+    notes = get_track_notes(track_messages, lowest_clock, separator_size)
+    notes = normalize_note_octaves(notes)
+    if ticks_per_beat:
+        return ticks_per_beat / lowest_clock, notes
+    return separator_size, notes
+
+def get_song_text(bpm, beat_size, notes):
+    return f"{int(bpm)} {beat_size}\n" + notes
+
+def midi_to_events(midi_path):
+    """
+    Compile every note of every track straight to the song event array, in a
+    single pass over each track's messages. Ticks become seconds through the
+    file's tempo map in one vectorized pass at the end.
+    """
+    midi = get_midi(midi_path)
+    tempo_ticks, tempos = [], []
+    numerator = 4
+
+    starts, ends, pitches, velocities, tracks = [], [], [], [], []
+    track_names = []
+    for i, track in enumerate(midi.tracks):
+        track_names.append(track.name or str(i))
+        ticks = 0
+        playing = {} # pitch -> index of the open event
+        for msg in track:
+            ticks += msg.time
+            kind = msg.type
+            if kind == 'set_tempo':
+                tempo_ticks.append(ticks)
+                tempos.append(msg.tempo)
+            elif kind == 'time_signature':
+                numerator = msg.numerator
+            elif kind == 'note_on' and msg.velocity > 0:
+                if msg.note in playing:
+                    ends[playing[msg.note]] = ticks
+                playing[msg.note] = len(starts)
+                starts.append(ticks)
+                ends.append(ticks)
+                pitches.append(msg.note)
+                velocities.append(msg.velocity)
+                tracks.append(i)
+            elif (kind == 'note_on' or kind == 'note_off') and msg.note in playing:
+                ends[playing.pop(msg.note)] = ticks
+        for index in playing.values(): # Never released, end with the track
+            ends[index] = ticks
+
+    tempo_map = TempoMap(tempo_ticks, tempos, midi.ticks_per_beat)
+    starts = tempo_map.to_seconds(starts)
+    ends = tempo_map.to_seconds(ends)
+    events = make_events(starts, ends - starts, pitches, velocities, tracks)
+    meta = {
+        "bpm": tempo_map.bpm,
+        "tempo_map": tempo_map.to_dict(),
+        "numerator": numerator,
+        "ticks_per_beat": midi.ticks_per_beat,
+        "tracks": track_names,
+        "normalized": False,
+    }
+    return events, meta
+
+def get_safe_name(name):
+    return re.sub(r'[\\/:*?"<>|]', "_", name).strip() or "_"
+
+def convert_midi(midi_path, out_base, song_format=SONG_FORMAT, separator_size_user=None, verbose=False):
+    """
+    Write out_base.npz and/or one out_base_<track>.txt per track, the MIDI file
+    is read once for both. Returns a summary, tracks that cannot be written as
+    text are listed under "failed" instead of stopping the others.
+    """
+    midi = get_midi(midi_path)
+    summary = {"tracks": len(midi.tracks), "outputs": [], "failed": []}
+    if song_format in ("events", "both"):
+        events, meta = midi_to_events(midi)
+        events_file = out_base + ".npz"
+        save_events(events_file, events, meta)
+        summary["notes"] = len(events)
+        summary["bpm"] = meta["bpm"]
+        summary["outputs"].append(events_file)
+    if song_format in ("text", "both"):
+        bpm, clock_size, numerator, track_notes = parse_midi_file(midi, verbose)
+        for track in track_notes:
+            try:
+                beat_size, notes = convert_track(
+                    track_notes[track], clock_size, numerator, separator_size_user, midi.ticks_per_beat
+                )
+            except Exception as e:
+                summary["failed"].append({"track": track, "error": f"{type(e).__name__}: {e}"})
+                continue
+            note_file = out_base + f"_{get_safe_name(track)}.txt"
+            with open(note_file, "w") as f:
+                f.write(get_song_text(bpm, beat_size, notes))
+            summary["outputs"].append(note_file)
+    return summary
+
     
 if __name__ == "__main__":
     midi_file = sys.argv[1] if (len(sys.argv) > 1) else "test.mid"
@@ -132,27 +277,8 @@ if __name__ == "__main__":
         separator_size_user = float(sys.argv[2])
     else:
         separator_size_user = None
-    bpm, clock_size, numerator, track_notes = parse_midi_file(midi_file)
-    for track in track_notes:
-        print(track)
-
-        if separator_size_user is not None:
-            beat_size = (numerator**2) / separator_size_user
-            separator_size = separator_size_user
-            lowest_clock = beat_size * clock_size
-        else:
-            times = {note.time for note in track_notes[track] if note.time % clock_size == 0} # Get all times that are a multiple of the note length
-            times.discard(0) # Discord notes with no time
-            lowest_clock = min(times) # Multiple of clock_size
-
-            beat_size: float = (lowest_clock / clock_size)# Beats per clock 
-            separator_size = (numerator**2) / (beat_size)
-
-        notes = get_track_notes(track_notes[track], lowest_clock, separator_size)
-        notes = normalize_note_octaves(notes)
-        
-        note_file = os.path.splitext(midi_file)[0] + f"_{track}.txt"
-        with open(note_file, "w") as f:
-            f.write(f"{int(bpm)} {separator_size}\n")
-            f.write(notes)
-
+    summary = convert_midi(midi_file, os.path.splitext(midi_file)[0], SONG_FORMAT, separator_size_user, verbose=True)
+    for failed in summary["failed"]:
+        print(f"Track {failed['track']} skipped: {failed['error']}")
+    for path in summary["outputs"]:
+        print(f"Saved {path}")
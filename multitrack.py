@@ -0,0 +1,161 @@
+import json
+import math
+import os
+import sys
+
+import numpy
+from tqdm import tqdm
+
+from audio_render import get_store_note_audio, render_store_audio, shift_note_audio
+from encoder_profiles import get_profile
+from frame_store import open_frame_store
+from midi_convertor import midi_to_events
+from pipe_renderer import (
+    FILL_COLOR,
+    WRITE_BATCH,
+    close_encoder,
+    compile_timeline,
+    open_encoder,
+    write_audio_file,
+)
+from pitch_resolver import resolve_notes
+from song_events import events_to_notes
+
+DATA_FOLDER = "input"
+OUTPUT_FOLDER = "output"
+
+
+def get_midi_voices(midi_path):
+    """
+    Parse every track of a MIDI file into a song, exactly as if it was written
+    out by midi_convertor.py as events and read back by load_song. Timing
+    follows the tempo map of the file.
+    """
+    events, meta = midi_to_events(midi_path)
+    voices = {}
+    for index in numpy.unique(events["track"]).tolist():
+        name = meta["tracks"][index]
+        voices[name if name not in voices else f"{name} {index}"] = events_to_notes(events, meta, index)
+    return voices
+
+
+def get_grid(count):
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    return rows, columns
+
+
+def get_tile_index(size, rows, columns):
+    """
+    Nearest neighbour source rows and columns for one downscaled tile.
+    """
+    width, height = size
+    tile_width, tile_height = width // columns, height // rows
+    ys = (numpy.arange(tile_height) * height / tile_height).astype(numpy.int64)
+    xs = (numpy.arange(tile_width) * width / tile_width).astype(numpy.int64)
+    return ys, xs
+
+
+def compose_frames(store, timelines, out_file, codec, audio_path):
+    """
+    Encode every voice side by side in a grid, all voices in one ffmpeg pass.
+    """
+    rows, columns = get_grid(len(timelines))
+    width, height = store.size
+    ys, xs = get_tile_index(store.size, rows, columns)
+    tile_height, tile_width = len(ys), len(xs)
+    frame_count = max(len(timeline) for timeline in timelines)
+    # Voices that end early hold fill frames until the longest one is done
+    padded = numpy.full((len(timelines), frame_count), -1, dtype=numpy.int64)
+    for i, timeline in enumerate(timelines):
+        padded[i, : len(timeline)] = timeline
+
+    process = open_encoder(
+        out_file, store.size, store.fps, codec, audio_path, store.sample_rate
+    )
+    batch = numpy.zeros((WRITE_BATCH, height, width, 3), numpy.uint8)
+    for start in tqdm(range(0, frame_count, WRITE_BATCH), desc="Frames"):
+        frames = batch[: min(WRITE_BATCH, frame_count - start)]
+        for i in range(len(timelines)):
+            row, column = divmod(i, columns)
+            tile = frames[
+                :,
+                row * tile_height : (row + 1) * tile_height,
+                column * tile_width : (column + 1) * tile_width,
+            ]
+            block = padded[i, start : start + len(frames)]
+            is_fill = block < 0
+            tile[is_fill] = FILL_COLOR
+            tile[~is_fill] = store.frame_array[
+                block[~is_fill][:, None, None], ys[None, :, None], xs[None, None, :]
+            ]
+        process.stdin.write(frames.data)
+    close_encoder(process, out_file)
+    return frame_count / store.fps
+
+
+def mix_voices(tracks):
+    """
+    Sum voices of different lengths, scaled down only if the mix would clip.
+    """
+    length = max(len(track) for track in tracks)
+    mix = numpy.zeros((length, tracks[0].shape[1]), numpy.float32)
+    for track in tracks:
+        mix[: len(track)] += track
+    peak = numpy.abs(mix).max() if len(mix) else 0
+    if peak > 1:
+        mix /= peak
+    return mix
+
+
+def render_multitrack(out_file, store, mapping_data, voices, codec):
+    """
+    Render every voice from one decoded store and one set of shifted notes.
+    """
+    resolved = {name: resolve_notes(mapping_data, notes) for name, notes in voices.items()}
+    # Shift the notes of all voices together so shared shifts are done once
+    shifted = shift_note_audio(
+        get_store_note_audio(store),
+        [resolution for voice in resolved.values() for resolution in voice],
+    )
+    timelines = []
+    tracks = []
+    for name, notes in voices.items():
+        timelines.append(compile_timeline(store, resolved[name], notes))
+        tracks.append(render_store_audio(store, resolved[name], notes, shifted=shifted))
+    audio_path = write_audio_file(mix_voices(tracks))
+    try:
+        return compose_frames(store, timelines, out_file, codec, audio_path)
+    finally:
+        os.remove(audio_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"Usage: python {sys.argv[0]} <input_name> <midi_file>")
+        sys.exit(1)
+
+    actor = sys.argv[1].strip()
+    midi_path = sys.argv[2].strip()
+
+    input_video_path = os.path.join(DATA_FOLDER, f"{actor}.mp4")
+    with open(os.path.join(DATA_FOLDER, f"{actor}.json"), "r") as f:
+        mappings = json.load(f)
+
+    voices = get_midi_voices(midi_path)
+    if not voices:
+        print("No tracks with notes found")
+        sys.exit(1)
+    rows, columns = get_grid(len(voices))
+    print(
+        f"Task -> Actor: {actor.title()} | MIDI: {midi_path} | {len(voices)} voices ({rows}x{columns}): {', '.join(voices)}"
+    )
+
+    store = open_frame_store(input_video_path, mappings)
+    output_folder = os.path.join(OUTPUT_FOLDER, actor)
+    os.makedirs(output_folder, exist_ok=True)
+    midi_name = os.path.splitext(os.path.basename(midi_path))[0]
+    out_file = os.path.join(output_folder, f"{midi_name}_multitrack_{actor}.mp4")
+    print(f"Saving to {out_file}")
+    duration = render_multitrack(out_file, store, mappings, voices, get_profile())
+    print("Duration: {:.2f}".format(duration))
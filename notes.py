@@ -0,0 +1,181 @@
+import io
+import re
+from array import array
+
+import numpy
+
+NOTE_PATTERN = re.compile(r"([A-G][#]?) ?([0-9]{0,2})")
+NOTES_ALPHABET = "C C# D D# E F F# G G# A A# B".split()
+MAX_OCTAVE_SHIFT = 10
+REST = -1
+TOKEN_BASE = 128
+
+
+def pitch_to_name(pitch):
+    """
+    Song notation of a pitch, 12 is C, 13 is C#, 24 is C2. Octave 1 is
+    written without a number.
+    """
+    octave = pitch // 12
+    letter = NOTES_ALPHABET[pitch % 12]
+    return letter if octave == 1 else f"{letter}{octave}"
+
+
+def name_to_pitch(note):
+    found = NOTE_PATTERN.fullmatch(note)
+    if not found or found.group(1) not in NOTES_ALPHABET:
+        raise Exception(f"Could not find note: {note}")
+    octave = int(found.group(2)) if found.group(2) else 1
+    return octave * 12 + NOTES_ALPHABET.index(found.group(1))
+
+
+def sample_to_seconds(sample, sample_rate):
+    return sample / sample_rate
+
+
+def mapping_to_timestamps(mapping, sample_rate):
+    start = mapping["start"]
+    end = mapping["length"] + start
+    return sample_to_seconds(start, sample_rate), sample_to_seconds(end, sample_rate)
+
+
+def get_note_starts(notes):
+    """
+    Start times relative to the first note, and durations, of a NoteSequence.
+    """
+    if not len(notes):
+        return numpy.zeros(0), numpy.zeros(0)
+    return notes.starts - notes.starts[0], notes.durations
+
+
+class NoteSequence:
+    """
+    Notes of a song as contiguous arrays. Pitches below TOKEN_BASE are song
+    pitches (12 is C), mapped names that are not notes get ids from TOKEN_BASE
+    on and REST marks the blank note a song can start with. Slicing returns
+    views sharing the same arrays.
+    """
+
+    def __init__(self, pitches, durations, starts=None, tokens=None):
+        self.pitches = numpy.asarray(pitches, dtype=numpy.int16)
+        self.durations = numpy.asarray(durations, dtype=numpy.float64)
+        if starts is None:
+            starts = numpy.zeros(len(self.durations))
+            numpy.cumsum(self.durations[:-1], out=starts[1:])
+        self.starts = starts
+        self.tokens = tokens if tokens is not None else []
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return NoteSequence(
+                self.pitches[index], self.durations[index], self.starts[index], self.tokens
+            )
+        return {"note": self.note(index), "duration": float(self.durations[index])}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def name(self, pitch):
+        if pitch == REST:
+            return ""
+        if pitch >= TOKEN_BASE:
+            return self.tokens[pitch - TOKEN_BASE]
+        return pitch_to_name(pitch)
+
+    def note(self, index):
+        return self.name(int(self.pitches[index]))
+
+    @property
+    def duration(self):
+        if not len(self):
+            return 0.0
+        return float(self.starts[-1] + self.durations[-1] - self.starts[0])
+
+    def time_slice(self, start, end):
+        """
+        View of the notes sounding in [start, end), in seconds from the first
+        note of this sequence.
+        """
+        if not len(self):
+            return self
+        base = self.starts[0]
+        first = max(0, numpy.searchsorted(self.starts, base + start, "right") - 1)
+        last = numpy.searchsorted(self.starts, base + end, "left")
+        return self[first:last]
+
+
+def get_note_id(token, ids, tokens):
+    note_id = ids.get(token)
+    if note_id is None:
+        try:
+            note_id = name_to_pitch(token)
+        except Exception:
+            note_id = TOKEN_BASE
+        if note_id >= TOKEN_BASE:
+            note_id = TOKEN_BASE + len(tokens)
+            tokens.append(token)
+        ids[token] = note_id
+    return note_id
+
+
+def iter_song_lines(f):
+    """
+    Lines after the header, like str.split("\n") a trailing newline gives a
+    last empty line.
+    """
+    line = ""
+    for line in f:
+        yield line[:-1] if line.endswith("\n") else line
+    if not line or line.endswith("\n"):
+        yield ""
+
+
+def read_notes(f):
+    """
+    Single pass tokenizer, every comma (or dash) starts a new time slot. An
+    empty slot extends the previous note.
+    """
+    header = f.readline()
+    if not header.endswith("\n"):
+        raise Exception("Could not find notes after tempo information")
+    tempo = header.strip().split(" ")
+    if not tempo[0]:
+        raise Exception("Could not find tempo information")
+    bpm = int(tempo[0].strip())
+    if len(tempo) == 1:  # Compatibility
+        beat_size = 4.0
+    else:
+        beat_size = float(tempo[1].strip())
+    bps = bpm / 60 * beat_size
+
+    pitches = array("h")
+    slots = array("q")
+    ids = {}
+    tokens = []
+    for line in iter_song_lines(f):
+        for token in line.replace("-", ",").replace("–", ",").split(","):
+            token = token.strip().upper()
+            if not token:
+                if not slots:
+                    pitches.append(REST)
+                    slots.append(1)
+                else:
+                    slots[-1] += 1
+                continue
+            pitches.append(get_note_id(token, ids, tokens))
+            slots.append(1)
+    durations = numpy.frombuffer(slots, dtype=numpy.int64) / bps
+    return bpm, beat_size, NoteSequence(numpy.frombuffer(pitches, dtype=numpy.int16), durations, tokens=tokens)
+
+
+def parse_notes(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return read_notes(f)
+
+
+def parse_notes_text(data):
+    return read_notes(io.StringIO(data))
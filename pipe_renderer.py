@@ -0,0 +1,161 @@
+import os
+import subprocess
+import tempfile
+
+import numpy
+from tqdm import tqdm
+
+from audio_render import render_store_audio
+from encoder_profiles import get_audio_args, get_video_args, resolve_threads
+from frame_store import CHANNELS, get_ffmpeg_binary
+from notes import get_note_starts
+from pitch_resolver import resolve_notes
+from tracing import count, span, traced
+
+FILL_COLOR = (0, 255, 0)
+WRITE_BATCH = 32
+
+
+@traced()
+def compile_timeline(store, resolved, notes):
+    """
+    Flatten the song into one store frame index per output frame, -1 marks a
+    fill frame. Mirrors get_note_video: each note plays its source clip for at
+    most its duration and is padded with fill frames for the rest.
+    """
+    starts, durations = get_note_starts(notes)
+    total = starts[-1] + durations[-1] if len(starts) else 0
+    frame_count = int(numpy.ceil(total * store.fps - 1e-9))
+    return map_frames(store, resolved, starts, durations, numpy.arange(frame_count))
+
+
+def map_frames(store, resolved, starts, durations, frames):
+    """
+    Store frame index of the output frames numbered frames, for notes starting
+    at starts seconds. The first note must start at or before the first frame.
+    """
+    fps = store.fps
+    offsets = numpy.zeros(len(resolved), dtype=numpy.int64)
+    counts = numpy.ones(len(resolved), dtype=numpy.int64)
+    played = numpy.zeros(len(resolved))
+    for i, resolution in enumerate(resolved):
+        if resolution is None:
+            continue
+        info = store.notes[resolution[0]]
+        offsets[i] = info["frame_offset"]
+        counts[i] = info["frame_count"]
+        played[i] = min(store.duration(resolution[0]), durations[i])
+
+    times = frames / fps
+    note_index = numpy.searchsorted(starts, times, side="right") - 1
+    local = times - starts[note_index]
+    source_frame = numpy.minimum(
+        (local * fps + 1e-6).astype(numpy.int64), counts[note_index] - 1
+    )
+    return numpy.where(
+        local < played[note_index], offsets[note_index] + source_frame, -1
+    )
+
+
+def write_audio_file(audio):
+    """
+    Dump audio as raw float32 PCM to a temporary file for ffmpeg to read.
+    """
+    fd, audio_path = tempfile.mkstemp(suffix=".f32")
+    with os.fdopen(fd, "wb") as f:
+        f.write(numpy.ascontiguousarray(audio, numpy.float32).data)
+    return audio_path
+
+
+def get_audio_input_args(audio_path, sample_rate):
+    return ["-f", "f32le", "-ar", str(sample_rate), "-ac", str(CHANNELS), "-i", audio_path]
+
+
+def open_encoder(out_file, size, fps, codec, audio_path=None, sample_rate=None, threads=None):
+    """
+    Start an ffmpeg process reading raw rgb24 frames from stdin, muxing in the
+    raw PCM at audio_path if given.
+    """
+    width, height = size
+    command = [
+        get_ffmpeg_binary(),
+        "-y",
+        "-loglevel", "error",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "-s", f"{width}x{height}",
+        "-r", f"{fps}",
+        "-i", "-",
+    ]
+    if audio_path:
+        command += get_audio_input_args(audio_path, sample_rate)
+        command += ["-map", "0:v", "-map", "1:a", *get_audio_args(codec)]
+    else:
+        command += ["-an"]
+    command += [
+        *get_video_args(codec),
+        "-threads", str(threads or resolve_threads(codec)),
+        out_file,
+    ]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def close_encoder(process, out_file):
+    process.stdin.close()
+    if process.wait() != 0:
+        raise Exception(f"ffmpeg failed writing {out_file}")
+
+
+def write_frames(out_file, store, frame_indices, codec, audio_path=None, threads=None, progress=True):
+    """
+    Stream frames straight from the store into a single ffmpeg process.
+    """
+    process = open_encoder(
+        out_file, store.size, store.fps, codec, audio_path, store.sample_rate, threads
+    )
+    with span("write_frames", "encode", out_file=out_file, frames=len(frame_indices)):
+        FrameWriter(process, store).write(frame_indices, progress)
+        close_encoder(process, out_file)
+
+
+class FrameWriter:
+    """
+    Copies store frames into a reused batch buffer and writes them to an
+    encoder, so memory does not depend on how many frames are written.
+    """
+
+    def __init__(self, process, store):
+        width, height = store.size
+        self.process = process
+        self.store = store
+        self.fill = numpy.empty((height, width, 3), numpy.uint8)
+        self.fill[:] = FILL_COLOR
+        self.batch = numpy.empty((WRITE_BATCH, height, width, 3), numpy.uint8)
+
+    def write(self, frame_indices, progress=False):
+        batches = range(0, len(frame_indices), WRITE_BATCH)
+        for i in tqdm(batches, desc="Frames", disable=not progress):
+            block = frame_indices[i : i + WRITE_BATCH]
+            frames = self.batch[: len(block)]
+            is_fill = block < 0
+            frames[is_fill] = self.fill
+            frames[~is_fill] = self.store.frame_array[block[~is_fill]]
+            self.process.stdin.write(frames.data)
+        count("frames_written", len(frame_indices))
+        count("fill_frames", int((frame_indices < 0).sum()))
+
+
+def write_video(out_file, store, frame_indices, audio, codec, threads=None):
+    audio_path = write_audio_file(audio)
+    try:
+        write_frames(out_file, store, frame_indices, codec, audio_path, threads)
+    finally:
+        os.remove(audio_path)
+
+
+def render_song(out_file, store, mapping_data, notes, codec, threads=None, shifted=None):
+    resolved = resolve_notes(mapping_data, notes)
+    frame_indices = compile_timeline(store, resolved, notes)
+    audio = render_store_audio(store, resolved, notes, shifted=shifted)
+    write_video(out_file, store, frame_indices, audio, codec, threads)
+    return len(frame_indices) / store.fps
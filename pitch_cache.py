@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy
+
+from tracing import count
+
+CACHE_FOLDER = "cache"
+PITCH_CACHE_FOLDER = os.path.join(CACHE_FOLDER, "pitch")
+PITCH_CACHE = os.environ.get("PITCH_CACHE", "true").lower() == "true"
+PITCH_CACHE_MB = float(os.environ.get("PITCH_CACHE_MB", "2048"))
+RESCAN_WRITES = 256  # Rescan now and then to see what other processes wrote
+EVICT_TO = 0.9  # Evict below this share of the limit so the next writes have room
+
+# (cache folder, suffix) -> [bytes, writes since the last scan], scanned once per process
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+
+def get_cache_key(audio_array, steps, sample_rate, tag=""):
+    """
+    Content address of a shift: the source samples, the shift in semitones,
+    the sample rate and an optional tag naming the shift implementation.
+    """
+    audio_array = numpy.ascontiguousarray(audio_array)
+    digest = hashlib.sha1()
+    digest.update(f"{audio_array.dtype.str}{audio_array.shape}".encode("utf-8"))
+    digest.update(audio_array.data)
+    digest.update(f"|{float(steps)}|{int(sample_rate)}|{tag}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_cache_path(key, cache_folder=PITCH_CACHE_FOLDER):
+    return os.path.join(cache_folder, key[:2], f"{key}.npy")
+
+
+def load_cached(key, cache_folder=PITCH_CACHE_FOLDER):
+    path = get_cache_path(key, cache_folder)
+    try:
+        shifted = numpy.load(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # Mark as recently used
+    except OSError:
+        pass
+    return shifted
+
+
+def store_cached(key, shifted, cache_folder=PITCH_CACHE_FOLDER):
+    path = get_cache_path(key, cache_folder)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so concurrent readers never see a partial file
+    fd, temp_path = tempfile.mkstemp(suffix=".npy", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        numpy.save(f, shifted)
+    os.replace(temp_path, path)
+    add_written(os.path.getsize(path), cache_folder)
+
+
+def add_written(size, cache_folder=PITCH_CACHE_FOLDER, suffix=".npy"):
+    """
+    Count a new entry towards the running size of a cache.
+    """
+    with _sizes_lock:
+        entry = _sizes.get((cache_folder, suffix))
+        if entry is not None:
+            entry[0] += size
+            entry[1] += 1
+
+
+def scan(cache_folder, suffix):
+    """
+    (mtime, size, path) of every entry and their total size.
+    """
+    entries = []
+    total = 0
+    for root, _, files in os.walk(cache_folder):
+        for name in files:
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    return entries, total
+
+
+def evict(max_mb=PITCH_CACHE_MB, cache_folder=PITCH_CACHE_FOLDER, suffix=".npy"):
+    """
+    Once the cache is over max_mb, delete least recently used entries until it
+    is below EVICT_TO of it. The folder is only scanned when the running size
+    crosses max_mb, on first use and every RESCAN_WRITES writes.
+    """
+    limit = max_mb * 1024 * 1024
+    with _sizes_lock:
+        entry = _sizes.get((cache_folder, suffix))
+        if entry is not None and entry[0] <= limit and entry[1] < RESCAN_WRITES:
+            return 0
+    entries, total = scan(cache_folder, suffix)
+    removed = 0
+    for _, size, path in sorted(entries) if total > limit else []:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+        if total <= limit * EVICT_TO:
+            break
+    with _sizes_lock:
+        _sizes[(cache_folder, suffix)] = [total, 0]
+    return removed
+
+
+def cached_pitch_shift_many(items, steps, sample_rate, shift_many_function, tag=""):
+    """
+    Shift a list of arrays by the same steps, reusing results of earlier runs
+    stored on disk. All misses are handed to shift_many_function in a single
+    call.
+    """
+    if not PITCH_CACHE:
+        return shift_many_function(items)
+    keys = [get_cache_key(item, steps, sample_rate, tag) for item in items]
+    results = [load_cached(key) for key in keys]
+    misses = [i for i, result in enumerate(results) if result is None]
+    count("pitch_cache.hit", len(items) - len(misses))
+    count("pitch_cache.miss", len(misses))
+    if misses:
+        shifted = shift_many_function([items[i] for i in misses])
+        for i, result in zip(misses, shifted):
+            store_cached(keys[i], result)
+            results[i] = result
+        evict()
+    return results
@@ -0,0 +1,158 @@
+import json
+import os
+import sys
+
+import numpy
+
+from notes import MAX_OCTAVE_SHIFT, REST, TOKEN_BASE, name_to_pitch, parse_notes
+
+PITCH_POLICY = os.environ.get("PITCH_POLICY", "octave").lower()
+MAX_SHIFT = int(os.environ["MAX_SHIFT"]) if os.environ.get("MAX_SHIFT") else None
+PITCH_COUNT = 128
+UNRESOLVED = -1
+
+
+class PitchResolver:
+    """
+    Table of the mapped note and semitone shift to use for every pitch, built
+    once per mapping. Policies:
+        octave:  same note name, nearest octave. The actor still says the right
+                 name so this is the default
+        minimal: nearest mapped note in semitones
+        down:    nearest mapped note at or above the pitch so notes are shifted
+                 down, falls back to shifting up
+    max_shift limits the shift in semitones, pitches further away are left
+    unresolved. When two source notes are equally close the higher one wins,
+    so the note is shifted down.
+    """
+
+    def __init__(self, mapping_data, policy=PITCH_POLICY, max_shift=MAX_SHIFT):
+        if policy not in ("octave", "minimal", "down"):
+            raise Exception(f"Unknown pitch policy {policy}, choose from octave, minimal, down")
+        self.mapping_data = mapping_data
+        self.policy = policy
+        self.max_shift = max_shift
+        self.sources = []
+        source_pitches = []
+        for name in mapping_data:
+            try:
+                pitch = name_to_pitch(name)
+            except Exception:
+                continue  # Not a note, only ever used by exact name
+            if pitch < PITCH_COUNT:
+                self.sources.append(name)
+                source_pitches.append(pitch)
+        self.source, self.shift = self.build_table(numpy.array(source_pitches, dtype=numpy.int64))
+
+    def build_table(self, source_pitches):
+        targets = numpy.arange(PITCH_COUNT)
+        source = numpy.full(PITCH_COUNT, UNRESOLVED, dtype=numpy.int16)
+        shift = numpy.zeros(PITCH_COUNT, dtype=numpy.int16)
+        if not len(source_pitches):
+            return source, shift
+        steps = targets[:, None] - source_pitches[None, :]
+        distance = numpy.abs(steps)
+        # Doubled so that shifting up loses ties against shifting down
+        cost = (distance * 2 + (steps > 0)).astype(numpy.float64)
+        if self.policy == "octave":
+            allowed = (steps % 12 == 0) & (distance <= MAX_OCTAVE_SHIFT * 12)
+            cost[~allowed] = numpy.inf
+        elif self.policy == "down":
+            cost[steps > 0] += 4 * PITCH_COUNT
+        if self.max_shift is not None:
+            cost[distance > self.max_shift] = numpy.inf
+        best = cost.argmin(axis=1)
+        found = numpy.isfinite(cost[targets, best])
+        source[found] = best[found]
+        shift[found] = steps[targets, best][found]
+        return source, shift
+
+    def lookup(self, pitch, notes=None):
+        """
+        (mapped note, semitone shift) for a pitch id of notes.
+        """
+        if pitch == REST:
+            return None
+        if pitch >= TOKEN_BASE:
+            name = notes.name(pitch)
+            if name not in self.mapping_data:
+                raise Exception(f"Could not find note: {name}")
+            return name, 0
+        if self.source[pitch] == UNRESOLVED:
+            name = notes.name(pitch) if notes is not None else pitch
+            raise Exception(f"Could not find base for note {name}")
+        return self.sources[self.source[pitch]], int(self.shift[pitch])
+
+    def resolve_name(self, name):
+        if name in self.mapping_data:
+            return name, 0
+        pitch = name_to_pitch(name)
+        if pitch >= PITCH_COUNT or self.source[pitch] == UNRESOLVED:
+            raise Exception(f"Could not find base for note {name}")
+        return self.sources[self.source[pitch]], int(self.shift[pitch])
+
+    def resolve(self, notes):
+        """
+        Resolution of every note of a NoteSequence, each distinct pitch is
+        looked up once.
+        """
+        lookup = {
+            pitch: self.lookup(pitch, notes)
+            for pitch in numpy.unique(notes.pitches).tolist()
+        }
+        return [lookup[pitch] for pitch in notes.pitches.tolist()]
+
+    def unresolved(self, notes):
+        """
+        Names of the notes of a sequence that cannot be resolved.
+        """
+        missing = []
+        for pitch in numpy.unique(notes.pitches).tolist():
+            try:
+                self.lookup(pitch, notes)
+            except Exception:
+                missing.append(notes.name(pitch))
+        return missing
+
+    def required_shifts(self, notes):
+        """
+        Unique (mapped note, semitone shift) pairs a song needs with how many
+        notes use each, so they can be shifted together up front.
+        """
+        pitches, counts = numpy.unique(notes.pitches, return_counts=True)
+        required = {}
+        for pitch, count in zip(pitches.tolist(), counts.tolist()):
+            resolution = self.lookup(pitch, notes)
+            if resolution is not None:
+                required[resolution] = required.get(resolution, 0) + count
+        return required
+
+
+def resolve_notes(mapping_data, notes, policy=PITCH_POLICY, max_shift=MAX_SHIFT):
+    """
+    Returns the (mapped note, semitone shift) pair for every note, blank notes
+    resolve to None.
+    """
+    return PitchResolver(mapping_data, policy, max_shift).resolve(notes)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"Usage: python {sys.argv[0]} <input_name> <song_name>")
+        print("Set PITCH_POLICY (octave, minimal, down) and MAX_SHIFT to compare policies")
+        sys.exit(1)
+
+    with open(os.path.join("input", f"{sys.argv[1]}.json"), "r") as f:
+        mappings = json.load(f)
+    _, _, notes = parse_notes(os.path.join("songs", f"{sys.argv[2]}.txt"))
+    resolver = PitchResolver(mappings)
+    missing = resolver.unresolved(notes)
+    if missing:
+        print(f"Unresolved notes: {', '.join(missing)}")
+        sys.exit(1)
+    required = resolver.required_shifts(notes)
+    total = sum(abs(shift) * count for (_, shift), count in required.items())
+    print(f"Policy: {resolver.policy} | Max shift: {resolver.max_shift} | {len(notes)} notes")
+    for (source, shift), count in sorted(required.items(), key=lambda item: -item[1]):
+        print(f"{source:>4} {shift:+3d} semitones x{count}")
+    print(f"Unique shifts: {sum(1 for _, shift in required if shift)} | Total shift distance: {total} semitones")
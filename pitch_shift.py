@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+
+import numpy
+
+from pitch_cache import cached_pitch_shift_many
+from tracing import count, span
+
+SAMPLE_RATE = 48000
+PITCH_BACKEND = os.environ.get("PITCH_BACKEND", "librosa").lower()
+CHANNELS = 2
+SHIFT_VERSION = 2  # Part of the pitch cache key, bump when backend output changes
+N_FFT = 2048
+HOP_LENGTH = N_FFT // 4
+
+
+def resample_linear(audio_array, length, ratio):
+    """
+    Read audio_array at ratio times its speed into length samples, reading
+    past the end gives silence.
+    """
+    positions = numpy.arange(length) * ratio
+    index = numpy.floor(positions).astype(numpy.int64)
+    frac = (positions - index).astype(numpy.float32)[:, None]
+    padded = numpy.concatenate(
+        (audio_array, numpy.zeros((2, audio_array.shape[1]), numpy.float32))
+    )
+    index = numpy.minimum(index, len(padded) - 2)
+    shifted = padded[index] * (1 - frac) + padded[index + 1] * frac
+    shifted[positions >= len(audio_array)] = 0
+    return shifted
+
+
+def shift_resample(audio_array, steps, sample_rate):
+    """
+    Tape style shift, faster playback raises the pitch. The note is shortened
+    or stretched with its timbre, length is kept by padding or cropping.
+    """
+    return resample_linear(audio_array, len(audio_array), 2.0 ** (steps / 12))
+
+
+def stft(audio_array, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """
+    Returns a (channels, frames, bins) spectrum of a (samples, channels) array.
+    """
+    window = numpy.hanning(n_fft + 1)[:-1].astype(numpy.float32)
+    padded = numpy.pad(audio_array.T, ((0, 0), (n_fft // 2, n_fft // 2)))
+    frame_count = 1 + max(0, padded.shape[1] - n_fft) // hop_length
+    index = numpy.arange(n_fft)[None, :] + hop_length * numpy.arange(frame_count)[:, None]
+    return numpy.fft.rfft(padded[:, index] * window, axis=-1).astype(numpy.complex64)
+
+
+def istft(spectrum, length, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    window = numpy.hanning(n_fft + 1)[:-1].astype(numpy.float32)
+    frames = numpy.fft.irfft(spectrum, n=n_fft, axis=-1).astype(numpy.float32) * window
+    channels, frame_count, _ = frames.shape
+    total = n_fft + hop_length * (frame_count - 1)
+    output = numpy.zeros((channels, total), numpy.float32)
+    norm = numpy.zeros(total, numpy.float32)
+    overlap = n_fft // hop_length
+    for i in range(overlap):
+        # Frames i, i + overlap, ... never overlap each other, add them in one go
+        block = frames[:, i::overlap]
+        start = hop_length * i
+        end = start + n_fft * block.shape[1]
+        output[:, start:end] += block.reshape(channels, -1)
+        norm[start:end] += numpy.tile(window**2, block.shape[1])
+    output /= numpy.maximum(norm, 1e-8)
+    output = output[:, n_fft // 2 :][:, :length].T
+    if len(output) < length:
+        output = numpy.pad(output, ((0, length - len(output)), (0, 0)))
+    return numpy.ascontiguousarray(output)
+
+
+def phase_vocoder(spectrum, rate, hop_length=HOP_LENGTH):
+    """
+    Time stretch a spectrum by rate, computed for every frame and channel at
+    once by accumulating the phase advance with cumsum.
+    """
+    _, frame_count, bins = spectrum.shape
+    steps = numpy.arange(0, frame_count, rate)
+    padded = numpy.concatenate((spectrum, numpy.zeros_like(spectrum[:, :2])), axis=1)
+    index = numpy.floor(steps).astype(numpy.int64)
+    alpha = (steps - index).astype(numpy.float32)[None, :, None]
+    left, right = padded[:, index], padded[:, index + 1]
+    magnitude = (1 - alpha) * numpy.abs(left) + alpha * numpy.abs(right)
+    phi_advance = numpy.linspace(0, numpy.pi * hop_length, bins)[None, None, :]
+    delta = numpy.angle(right) - numpy.angle(left) - phi_advance
+    delta -= 2 * numpy.pi * numpy.round(delta / (2 * numpy.pi))
+    increment = phi_advance + delta
+    phase = numpy.angle(spectrum[:, :1]) + numpy.concatenate(
+        (numpy.zeros_like(increment[:, :1]), numpy.cumsum(increment[:, :-1], axis=1)),
+        axis=1,
+    )
+    # Accumulate in float64, wrap before going back to single precision
+    phase = numpy.mod(phase, 2 * numpy.pi).astype(numpy.float32)
+    return magnitude * (numpy.cos(phase) + 1j * numpy.sin(phase)).astype(numpy.complex64)
+
+
+def stack(items):
+    """
+    Zero pad notes to the longest one and lay their channels side by side, so
+    every channel of every note is its own signal with its own phase.
+    """
+    stacked = numpy.zeros((max(len(item) for item in items), CHANNELS * len(items)), numpy.float32)
+    for i, item in enumerate(items):
+        stacked[: len(item), CHANNELS * i : CHANNELS * (i + 1)] = item
+    return stacked
+
+
+def shift_resample_many(items, steps, sample_rate):
+    return [shift_resample(item, steps, sample_rate) for item in items]
+
+
+def shift_vocoder_many(items, steps, sample_rate):
+    """
+    Phase vocoder stretch followed by a resample back to the original length.
+    All notes go through a single STFT with one row per channel.
+    """
+    rate = 2.0 ** (-steps / 12)
+    stacked = stack(items)
+    stretched = istft(phase_vocoder(stft(stacked), rate), int(round(len(stacked) / rate)))
+    results = []
+    for i, item in enumerate(items):
+        stretched_length = int(round(len(item) / rate))
+        channels = stretched[:stretched_length, CHANNELS * i : CHANNELS * (i + 1)]
+        results.append(resample_linear(channels, len(item), stretched_length / len(item)))
+    return results
+
+
+def shift_librosa_many(items, steps, sample_rate):
+    """
+    Reference implementation, one multichannel call with a row per channel.
+    """
+    import librosa
+
+    shifted = librosa.effects.pitch_shift(stack(items).T, sr=sample_rate, n_steps=steps).T
+    return [
+        numpy.ascontiguousarray(shifted[: len(item), CHANNELS * i : CHANNELS * (i + 1)])
+        for i, item in enumerate(items)
+    ]
+
+
+BACKENDS = {
+    "resample": shift_resample_many,
+    "vocoder": shift_vocoder_many,
+    "librosa": shift_librosa_many,
+}
+
+
+def get_backend(backend):
+    if backend not in BACKENDS:
+        raise Exception(
+            f"Unknown pitch shift backend {backend}, choose from {', '.join(BACKENDS)}"
+        )
+    return BACKENDS[backend]
+
+
+def shift_batch(items, steps, sample_rate=SAMPLE_RATE, backend=PITCH_BACKEND):
+    """
+    Shift every stereo array in items by the same amount of semitones in a
+    single backend call, each one exactly as if it were shifted alone.
+    """
+    shift_function = get_backend(backend)
+    items = [numpy.asarray(item, dtype=numpy.float32) for item in items]
+    count("shifts", len(items))
+    with span("shift_batch", "shift", steps=steps, notes=len(items), backend=backend):
+        if not items:
+            return []
+        return shift_function(items, steps, sample_rate)
+
+
+def shift_audio_many(items, steps, sample_rate=SAMPLE_RATE, backend=PITCH_BACKEND):
+    """
+    shift_batch backed by the persistent pitch cache, only the misses are shifted.
+    """
+    return cached_pitch_shift_many(
+        items,
+        steps,
+        sample_rate,
+        lambda misses: shift_batch(misses, steps, sample_rate, backend),
+        tag=f"{backend}:{SHIFT_VERSION}",
+    )
+
+
+def shift_audio(audio_array, steps, sample_rate=SAMPLE_RATE, backend=PITCH_BACKEND):
+    return shift_audio_many([audio_array], steps, sample_rate, backend)[0]
+
+
+def estimate_pitch(audio_array, sample_rate):
+    """
+    Frequency of the strongest FFT peak, refined by parabolic interpolation.
+    """
+    mono = audio_array.mean(axis=1) * numpy.hanning(len(audio_array))
+    spectrum = numpy.abs(numpy.fft.rfft(mono))
+    peak = int(spectrum[1:-1].argmax()) + 1
+    a, b, c = numpy.log(spectrum[peak - 1 : peak + 2] + 1e-12)
+    offset = 0.5 * (a - c) / (a - 2 * b + c)
+    return (peak + offset) * sample_rate / len(mono)
+
+
+def benchmark(duration=1.0, sample_rate=SAMPLE_RATE, shifts=(-12, -7, -2, 2, 7, 12)):
+    """
+    Shift a synthetic tone with every backend and report time taken and pitch
+    error in cents, measured over the middle of the note. Levels are checked
+    too: the channels against each other, and three notes shifted in one batch
+    against the same notes shifted one at a time.
+    """
+    base = 220.0
+    t = numpy.arange(int(duration * sample_rate)) / sample_rate
+    tone = sum(0.4 / k * numpy.sin(2 * numpy.pi * base * k * t) for k in (1, 2, 3))
+    audio_array = numpy.stack((tone, tone), axis=1).astype(numpy.float32)
+    # Different pitches and lengths, like the notes of one shift in a song
+    tones = [
+        numpy.repeat(0.3 * numpy.sin(2 * numpy.pi * frequency * t[: int(len(t) * scale)])[:, None], 2, axis=1).astype(numpy.float32)
+        for frequency, scale in ((220, 1.0), (330, 0.8), (440, 0.6))
+    ]
+    results = {}
+    for backend, shift_function in BACKENDS.items():
+        shift_function([audio_array], 1, sample_rate)  # Warm up
+        timings = []
+        errors = []
+        balances = []
+        for steps in shifts:
+            start = time.perf_counter()
+            shifted = shift_function([audio_array], steps, sample_rate)[0]
+            timings.append(time.perf_counter() - start)
+            middle = get_middle(shifted, steps)
+            expected = base * 2.0 ** (steps / 12)
+            errors.append(abs(1200 * numpy.log2(estimate_pitch(middle, sample_rate) / expected)))
+            balances.append(abs(get_db(middle[:, 0]) - get_db(middle[:, 1])))
+        batch = shift_function(tones, 5, sample_rate)
+        single = [shift_function([tone_array], 5, sample_rate)[0] for tone_array in tones]
+        batch_error = max(
+            abs(get_db(get_middle(a, 5)) - get_db(get_middle(b, 5))) for a, b in zip(batch, single)
+        )
+        results[backend] = {
+            "seconds_per_note": float(numpy.mean(timings)),
+            "realtime_factor": float(duration / numpy.mean(timings)),
+            "mean_error_cents": float(numpy.mean(errors)),
+            "max_error_cents": float(numpy.max(errors)),
+            "max_balance_db": float(numpy.max(balances)),
+            "batch_error_db": float(batch_error),
+        }
+    return results
+
+
+def get_middle(shifted, steps):
+    """
+    Middle half of a shifted note. The resample backend shortens notes shifted
+    up, only what is left is used.
+    """
+    usable = int(len(shifted) * min(1, 2.0 ** (-steps / 12)))
+    return shifted[usable // 4 : usable * 3 // 4]
+
+
+def get_db(audio_array):
+    return 20 * numpy.log10(numpy.sqrt(numpy.mean(numpy.square(audio_array, dtype=numpy.float64))) + 1e-12)
+
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    print(f"Shifting a {duration:.2f}s stereo tone at {SAMPLE_RATE}Hz")
+    print(
+        f"{'Backend':<10}{'s/note':>10}{'x realtime':>12}{'mean cents':>12}{'max cents':>11}"
+        f"{'L/R dB':>8}{'batch dB':>10}"
+    )
+    for backend, result in benchmark(duration).items():
+        print(
+            f"{backend:<10}{result['seconds_per_note']:>10.4f}{result['realtime_factor']:>12.1f}"
+            f"{result['mean_error_cents']:>12.2f}{result['max_error_cents']:>11.2f}"
+            f"{result['max_balance_db']:>8.2f}{result['batch_error_db']:>10.2f}"
+        )
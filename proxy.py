@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from frame_store import get_ffmpeg_binary
+
+DRAFT = os.environ.get("DRAFT", "false").lower() == "true"
+DRAFT_CODEC = "draft"
+PROXY_HEIGHT = int(os.environ.get("PROXY_HEIGHT", "240"))
+PROXY_FPS = int(os.environ.get("PROXY_FPS", "12"))
+
+
+def get_proxy_path(video_path, height=PROXY_HEIGHT, fps=PROXY_FPS):
+    """
+    Proxies live next to their source, input/thethiny.mp4 gets
+    input/thethiny.proxy_240p12.mp4.
+    """
+    path, ext = os.path.splitext(video_path)
+    return f"{path}.proxy_{height}p{fps}{ext}"
+
+
+def is_proxy_current(video_path, proxy_path):
+    try:
+        return os.path.getmtime(proxy_path) >= os.path.getmtime(video_path)
+    except OSError:
+        return False
+
+
+def build_proxy(video_path, proxy_path, height=PROXY_HEIGHT, fps=PROXY_FPS):
+    """
+    Scale video_path down to height (keeping the aspect ratio) and fps, never
+    above the source. The audio stream is copied untouched so drafts sound
+    like final renders.
+    """
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    infos = ffmpeg_parse_infos(video_path)
+    height = min(height, infos["video_size"][1])
+    fps = min(fps, infos["video_fps"])
+    # Unique per build so concurrent builds of the same proxy never share a file
+    fd, temp_path = tempfile.mkstemp(
+        prefix=os.path.basename(proxy_path) + ".",
+        suffix=os.path.splitext(proxy_path)[1],
+        dir=os.path.dirname(proxy_path) or ".",
+    )
+    os.close(fd)
+    command = [
+        get_ffmpeg_binary(),
+        "-y",
+        "-loglevel", "error",
+        "-i", video_path,
+        "-vf", f"scale=-2:{height},fps={fps:g}",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", "28",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "copy",
+        temp_path,
+    ]
+    try:
+        subprocess.run(command, check=True)
+        os.replace(temp_path, proxy_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return proxy_path
+
+
+def get_proxy(video_path, height=PROXY_HEIGHT, fps=PROXY_FPS):
+    """
+    Path of an up to date proxy of video_path, building it first if needed.
+    """
+    proxy_path = get_proxy_path(video_path, height, fps)
+    if not is_proxy_current(video_path, proxy_path):
+        print(f"Building proxy {proxy_path}")
+        build_proxy(video_path, proxy_path, height, fps)
+    return proxy_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <input_name> [<input_name> ...]")
+        print("Set PROXY_HEIGHT and PROXY_FPS to change the proxy size")
+        sys.exit(1)
+
+    for actor in sys.argv[1:]:
+        print(get_proxy(os.path.join("input", f"{actor}.mp4")))
@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+DAEMON_HOST = os.environ.get("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.environ.get("DAEMON_PORT", "8765"))
+DRAFT = os.environ.get("DRAFT", "false").lower() == "true"
+POLL_SECONDS = 0.5
+
+
+def request_json(path, data=None, host=DAEMON_HOST, port=DAEMON_PORT):
+    request = urllib.request.Request(
+        f"http://{host}:{port}{path}",
+        data=json.dumps(data).encode("utf-8") if data is not None else None,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def submit_job(actor, song, codec=None, engine=None, track=None, draft=DRAFT, wait=True):
+    """
+    Queue a job and optionally wait for it, printing its progress. The daemon
+    picks the codec and engine when they are not given.
+    """
+    job = request_json(
+        "/jobs",
+        {
+            "actor": actor,
+            "song": song,
+            "codec": codec,
+            "engine": engine,
+            "track": track,
+            "draft": draft,
+        },
+    )
+    if "id" not in job:
+        print(f"Error: {job.get('error')}")
+        return job
+    print(f"Job {job['id']} queued")
+    status = job["status"]
+    while wait and job["status"] not in ("done", "failed"):
+        time.sleep(POLL_SECONDS)
+        job = request_json(f"/jobs/{job['id']}")
+        if job["status"] != status:
+            status = job["status"]
+            print(f"Job {job['id']} {status}")
+    if job["status"] == "done":
+        print(f"Saved {job['out_file']} ({job['duration']:.2f}s) in {job['seconds']:.2f}s")
+    elif job["status"] == "failed":
+        print(f"Failed: {job['error']}")
+    return job
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("submit", "status"):
+        print(f"Usage: python {sys.argv[0]} submit <input_name> <song_name> [<codec>] [<engine>] [<track>]")
+        print(f"       python {sys.argv[0]} status [<job_id>]")
+        sys.exit(1)
+
+    if sys.argv[1] == "submit":
+        if len(sys.argv) < 4:
+            print(f"Usage: python {sys.argv[0]} submit <input_name> <song_name> [<codec>] [<engine>] [<track>]")
+            sys.exit(1)
+        job = submit_job(*sys.argv[2:7])
+        sys.exit(0 if job.get("status") == "done" else 1)
+    else:
+        path = f"/jobs/{sys.argv[2]}" if len(sys.argv) > 2 else "/status"
+        print(json.dumps(request_json(path), indent=4))
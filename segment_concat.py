@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+import numpy
+from tqdm import tqdm
+
+from audio_render import render_store_audio
+from encoder_profiles import get_audio_args
+from frame_store import get_ffmpeg_binary
+from notes import get_note_starts
+from pipe_renderer import get_audio_input_args, write_audio_file, write_frames
+from pitch_resolver import resolve_notes
+from tracing import span, traced
+
+
+def get_note_frames(notes, fps):
+    """
+    Frame count of every note once note boundaries are snapped to frames, so
+    segments can be joined without drifting.
+    """
+    starts, durations = get_note_starts(notes)
+    edges = numpy.round(numpy.append(starts, starts[-1] + durations[-1]) * fps)
+    return numpy.diff(edges.astype(numpy.int64))
+
+
+def get_segments(store, mapping_data, notes):
+    """
+    Returns the segment key of every note and the unique segment keys in order
+    of first use. A key is (mapped note, frame count), blank notes use
+    (None, frame count). Segments are video only, so notes shifted by any
+    amount share one.
+    """
+    resolved = resolve_notes(mapping_data, notes)
+    frame_counts = get_note_frames(notes, store.fps)
+    keys = []
+    for resolution, frame_count in zip(resolved, frame_counts):
+        if frame_count <= 0:
+            keys.append(None)
+            continue
+        find_note = resolution[0] if resolution else None
+        keys.append((find_note, int(frame_count)))
+    unique = list(dict.fromkeys(key for key in keys if key is not None))
+    return resolved, keys, unique
+
+
+def get_segment_frames(store, key):
+    find_note, frame_count = key
+    if find_note is None:
+        return numpy.full(frame_count, -1, dtype=numpy.int64)
+    info = store.notes[find_note]
+    local = numpy.arange(frame_count) / store.fps
+    source_frame = numpy.minimum(
+        (local * store.fps + 1e-6).astype(numpy.int64), info["frame_count"] - 1
+    )
+    return numpy.where(
+        local < store.duration(find_note), info["frame_offset"] + source_frame, -1
+    )
+
+
+@traced(category="encode")
+def encode_segments(store, unique, codec, segment_folder, workers=None):
+    """
+    Encode every unique segment once, video only, with identical encoder
+    settings so the results can be stream copied together.
+    """
+    paths = {
+        key: os.path.join(segment_folder, f"segment_{i}.mp4")
+        for i, key in enumerate(unique)
+    }
+
+    def encode(key):
+        with span("encode_segment", "encode", note=key[0], frames=key[1]):
+            write_frames(
+                paths[key],
+                store,
+                get_segment_frames(store, key),
+                codec,
+                threads=1,
+                progress=False,
+            )
+
+    with ThreadPool(workers or os.cpu_count()) as pool:
+        for _ in tqdm(pool.imap_unordered(encode, unique), desc="Segments", total=len(unique)):
+            pass
+    return paths
+
+
+@traced(category="encode")
+def concat_segments(out_file, segment_paths, audio_path, sample_rate, codec):
+    """
+    Join segments with the concat demuxer using stream copy, the audio track is
+    encoded once from the full song buffer.
+    """
+    fd, list_path = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            path = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+    command = [
+        get_ffmpeg_binary(),
+        "-y",
+        "-loglevel", "error",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_path,
+    ]
+    if audio_path:
+        command += get_audio_input_args(audio_path, sample_rate)
+        command += ["-map", "0:v", "-map", "1:a", *get_audio_args(codec)]
+    command += ["-c:v", "copy", out_file]
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_path)
+
+
+def render_song_concat(out_file, store, mapping_data, notes, codec, shifted=None, workers=None):
+    resolved, keys, unique = get_segments(store, mapping_data, notes)
+    used = sum(1 for key in keys if key is not None)
+    print(f"Segments: {len(unique)} unique out of {used}")
+    segment_folder = tempfile.mkdtemp(prefix="segments_")
+    audio_path = write_audio_file(render_store_audio(store, resolved, notes, shifted=shifted))
+    try:
+        paths = encode_segments(store, unique, codec, segment_folder, workers)
+        concat_segments(
+            out_file,
+            [paths[key] for key in keys if key is not None],
+            audio_path,
+            store.sample_rate,
+            codec,
+        )
+    finally:
+        os.remove(audio_path)
+        shutil.rmtree(segment_folder, ignore_errors=True)
+    return sum(key[1] for key in keys if key is not None) / store.fps
@@ -0,0 +1,247 @@
+import json
+import math
+import subprocess
+
+import numpy
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+MIN_SILENCE_LEN = 250  # ms
+SILENCE_OFFSET = 16  # dB below the overall loudness
+MIN_NOTE_LEN = 100  # ms, shortest span an onset split may produce
+ONSET_FRAME = 10  # ms
+CHANNELS = 2
+BLOCK_SECONDS = 10
+MAX_AMPLITUDE = 32768
+
+
+def get_sample_rate(video_path):
+    infos = ffmpeg_parse_infos(video_path)
+    if not infos.get("audio_found"):
+        raise Exception(f"No audio stream found in {video_path}")
+    return int(infos["audio_fps"])
+
+
+def iter_pcm_blocks(video_path, sample_rate, channels=CHANNELS, block_seconds=BLOCK_SECONDS):
+    """
+    Yield int16 arrays of shape (frames, channels) decoded by ffmpeg, block_seconds
+    at a time, so memory use does not depend on the length of the recording.
+    """
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-loglevel", "error",
+        "-i", video_path,
+        "-vn",
+        "-f", "s16le",
+        "-ac", str(channels),
+        "-ar", str(sample_rate),
+        "-",
+    ]
+    frame_bytes = 2 * channels
+    block_bytes = sample_rate * block_seconds * frame_bytes
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    pending = b""
+    try:
+        while True:
+            chunk = process.stdout.read(block_bytes)
+            if not chunk:
+                break
+            data = pending + chunk
+            usable = len(data) // frame_bytes * frame_bytes
+            pending = data[usable:]
+            if usable:
+                yield numpy.frombuffer(data[:usable], numpy.int16).reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+class SignalEnergy:
+    """
+    Sum of squared samples per millisecond of a recording. Everything the
+    segmentation needs is derived from it, so it can be kept around and
+    re-thresholded without decoding the video again.
+    """
+
+    def __init__(self, energy, sample_rate, channels=CHANNELS, frame_count=None):
+        self.energy = numpy.asarray(energy, numpy.float64)
+        self.sample_rate = int(sample_rate)
+        self.channels = channels
+        if frame_count is None:
+            frame_count = len(self.energy) * self.sample_rate // 1000
+        self.frame_count = int(frame_count)
+
+    def __len__(self):
+        """
+        Length in milliseconds, rounded the same way pydub does.
+        """
+        return int(round(1000 * self.frame_count / self.sample_rate))
+
+    def edges(self, ms):
+        """
+        First sample frame of each millisecond in ms.
+        """
+        return numpy.asarray(ms, numpy.int64) * self.sample_rate // 1000
+
+    def rms(self, start_ms=0, end_ms=None):
+        if end_ms is None:
+            end_ms, end = len(self.energy), self.frame_count
+        else:
+            end = min(self.frame_count, int(self.edges(end_ms)))
+        frames = end - int(self.edges(start_ms))
+        if frames <= 0:
+            return 0
+        return int(math.sqrt(self.energy[start_ms:end_ms].sum() / (frames * self.channels)))
+
+    @property
+    def dBFS(self):
+        rms = self.rms()
+        if not rms:
+            return -float("inf")
+        return 20 * math.log10(rms / MAX_AMPLITUDE)
+
+    def window_rms(self, window):
+        """
+        RMS of every window ms long window, one per starting millisecond.
+        """
+        count = len(self) - window + 1
+        if count <= 0:
+            return numpy.zeros(0)
+        total = numpy.concatenate([[0.0], numpy.cumsum(self.energy)])
+        starts = numpy.arange(count)
+        ends = numpy.minimum(starts + window, len(self.energy))
+        frames = numpy.minimum(self.edges(starts + window), self.frame_count) - self.edges(starts)
+        return numpy.floor(numpy.sqrt((total[ends] - total[starts]) / (frames * self.channels)))
+
+    def frame_db(self, frame=ONSET_FRAME):
+        """
+        Loudness in dBFS of consecutive frame ms long frames.
+        """
+        count = len(self.energy) // frame
+        energy = self.energy[: count * frame].reshape(count, frame).sum(axis=1)
+        frames = numpy.diff(self.edges(numpy.arange(count + 1) * frame))
+        rms = numpy.sqrt(energy / numpy.maximum(frames * self.channels, 1))
+        return 20 * numpy.log10(numpy.maximum(rms, 1) / MAX_AMPLITUDE)
+
+    def save(self, path):
+        numpy.savez_compressed(
+            path,
+            energy=self.energy,
+            meta=json.dumps(
+                {
+                    "sample_rate": self.sample_rate,
+                    "channels": self.channels,
+                    "frame_count": self.frame_count,
+                }
+            ),
+        )
+
+
+def load_energy(path):
+    with numpy.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        return SignalEnergy(data["energy"], **meta)
+
+
+def read_energy(video_path, sample_rate=None, channels=CHANNELS):
+    """
+    Decode the audio of video_path in blocks and reduce it to a SignalEnergy.
+    """
+    sample_rate = sample_rate or get_sample_rate(video_path)
+    energy = numpy.zeros(0)
+    frame_count = 0
+    for block in iter_pcm_blocks(video_path, sample_rate, channels):
+        samples = block.astype(numpy.float64)
+        frame_energy = numpy.einsum("ij,ij->i", samples, samples)
+        frames = numpy.arange(frame_count, frame_count + len(block), dtype=numpy.int64)
+        # Millisecond i covers sample frames [i * sr // 1000, (i + 1) * sr // 1000)
+        ms = (1000 * (frames + 1) - 1) // sample_rate
+        counts = numpy.bincount(ms - ms[0], weights=frame_energy)
+        end = ms[0] + len(counts)
+        if len(energy) < end:
+            energy = numpy.concatenate([energy, numpy.zeros(end - len(energy))])
+        energy[ms[0] : end] += counts
+        frame_count += len(block)
+    return SignalEnergy(energy, sample_rate, channels, frame_count)
+
+
+def detect_silence(signal, min_silence_len=MIN_SILENCE_LEN, silence_thresh=None):
+    """
+    Silent [start, end] ranges in ms, matching pydub.silence.detect_silence
+    with seek_step=1. silence_thresh is in dBFS and defaults to
+    signal.dBFS - SILENCE_OFFSET.
+    """
+    if len(signal) < min_silence_len:
+        return []
+    if silence_thresh is None:
+        silence_thresh = signal.dBFS - SILENCE_OFFSET
+    threshold = 10 ** (silence_thresh / 20) * MAX_AMPLITUDE
+    silence_starts = numpy.flatnonzero(signal.window_rms(min_silence_len) <= threshold)
+    if not len(silence_starts):
+        return []
+    # Windows that start within min_silence_len of each other belong to the same range
+    breaks = numpy.flatnonzero(numpy.diff(silence_starts) > min_silence_len)
+    firsts = silence_starts[numpy.concatenate([[0], breaks + 1])]
+    lasts = silence_starts[numpy.concatenate([breaks, [len(silence_starts) - 1]])]
+    return [[int(start), int(end) + min_silence_len] for start, end in zip(firsts, lasts)]
+
+
+def detect_nonsilent(signal, min_silence_len=MIN_SILENCE_LEN, silence_thresh=None):
+    """
+    Inverse of detect_silence, matching pydub.silence.detect_nonsilent.
+    """
+    length = len(signal)
+    silent_ranges = detect_silence(signal, min_silence_len, silence_thresh)
+    if not silent_ranges:
+        return [[0, length]]
+    if silent_ranges[0] == [0, length]:
+        return []
+    ranges = []
+    previous_end = 0
+    for start, end in silent_ranges:
+        ranges.append([previous_end, start])
+        previous_end = end
+    if silent_ranges[-1][1] != length:
+        ranges.append([previous_end, length])
+    if ranges[0] == [0, 0]:
+        ranges.pop(0)
+    return ranges
+
+
+def split_onsets(signal, ranges, onset_db, min_note_len=MIN_NOTE_LEN, frame=ONSET_FRAME):
+    """
+    Split ranges wherever the loudness jumps by more than onset_db between two
+    consecutive frames, for notes that were spoken without a pause in between.
+    """
+    loudness = signal.frame_db(frame)
+    rise = numpy.diff(loudness, prepend=loudness[:1]) if len(loudness) else loudness
+    result = []
+    for start, end in ranges:
+        onsets = numpy.flatnonzero(rise[start // frame : end // frame] > onset_db)
+        cut = start
+        for onset in (onsets + start // frame) * frame:
+            if onset - cut >= min_note_len and end - onset >= min_note_len:
+                result.append([cut, int(onset)])
+                cut = int(onset)
+        result.append([cut, end])
+    return result
+
+
+def segment_video(
+    video_path,
+    min_silence_len=MIN_SILENCE_LEN,
+    silence_offset=SILENCE_OFFSET,
+    onset_db=None,
+    signal=None,
+):
+    """
+    Note spans of video_path in ms, along with the SignalEnergy they were
+    found in. Pass signal to re-threshold without decoding again.
+    """
+    if signal is None:
+        signal = read_energy(video_path)
+    ranges = detect_nonsilent(signal, min_silence_len, signal.dBFS - silence_offset)
+    if onset_db is not None:
+        ranges = split_onsets(signal, ranges, onset_db)
+    return ranges, signal
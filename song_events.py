@@ -0,0 +1,158 @@
+import json
+import os
+import sys
+
+import numpy
+
+from notes import REST, NoteSequence, parse_notes
+
+EVENT_DTYPE = numpy.dtype(
+    [
+        ("start", "<f8"),  # Seconds from the start of the song
+        ("duration", "<f8"),  # Seconds
+        ("pitch", "<i2"),  # MIDI pitch, or song pitch (12 is C) once normalized
+        ("velocity", "u1"),
+        ("track", "<u2"),
+    ]
+)
+TEXT_LINE_LENGTH = 32  # Tokens per line when exporting to text
+
+
+def make_events(starts, durations, pitches, velocities, tracks):
+    events = numpy.empty(len(starts), dtype=EVENT_DTYPE)
+    events["start"] = starts
+    events["duration"] = durations
+    events["pitch"] = pitches
+    events["velocity"] = velocities
+    events["track"] = tracks
+    # Stable so simultaneous notes keep their file order
+    return events[numpy.argsort(events["start"], kind="stable")]
+
+
+def save_events(path, events, meta):
+    numpy.savez(path, events=events, meta=numpy.array(json.dumps(meta)))
+
+
+def load_events(path):
+    with numpy.load(path) as data:
+        return data["events"].astype(EVENT_DTYPE), json.loads(str(data["meta"]))
+
+
+def get_track_index(meta, track=None):
+    """
+    Index of a track given by name or index, None when no track is given.
+    """
+    if track is None:
+        return None
+    if track in meta["tracks"]:
+        return meta["tracks"].index(track)
+    try:
+        index = int(track)
+    except (TypeError, ValueError):
+        index = None
+    if index is None or not 0 <= index < len(meta["tracks"]):
+        raise ValueError(f"Unknown track {track}, available: {', '.join(meta['tracks'])}")
+    return index
+
+
+def events_to_notes(events, meta, track=None):
+    """
+    Turn one track of events into the NoteSequence parse_notes returns. The song
+    format plays one note at a time, each note lasts until the next one starts.
+    """
+    index = get_track_index(meta, track)
+    if index is None and len(events):
+        index = int(events["track"][0])
+    events = events[events["track"] == index]
+    # Only the first of the notes starting together can be played
+    keep = numpy.ones(len(events), dtype=bool)
+    keep[1:] = numpy.diff(events["start"]) > 0
+    events = events[keep]
+    tokens = meta.get("tokens", [])
+    if not len(events):
+        return NoteSequence([], [], tokens=tokens)
+
+    pitches = events["pitch"].astype(numpy.int64)
+    if not meta.get("normalized", False):
+        # Same as normalize_note_octaves, lowest octave becomes octave 1
+        pitches = pitches - (pitches.min() // 12 - 1) * 12
+    starts = events["start"]
+    ends = numpy.append(starts[1:], starts[-1] + events["duration"][-1])
+    durations = ends - starts
+
+    if starts[0] > 0:
+        pitches = numpy.append(REST, pitches)
+        durations = numpy.append(starts[0], durations)
+    return NoteSequence(pitches, durations, tokens=tokens)
+
+
+def text_to_events(path):
+    """
+    Import a song text file as a single track of events.
+    """
+    bpm, beat_size, notes = parse_notes(path)
+    played = notes.pitches != REST
+    starts = notes.starts[played]
+    durations = numpy.diff(numpy.append(starts, notes.duration))
+    events = make_events(starts, durations, notes.pitches[played], 100, 0)
+    meta = {
+        "bpm": bpm,
+        "beat_size": beat_size,
+        "tracks": [os.path.splitext(os.path.basename(path))[0]],
+        "normalized": True,
+        "tokens": notes.tokens,
+    }
+    return events, meta
+
+
+def events_to_text(events, meta, track=None):
+    """
+    Export one track to the song text format. Note boundaries are quantized to
+    the song's beat size, or to the shortest note when the song has none, so
+    rounding never adds up into drift. The header can only hold one tempo,
+    the starting one.
+    """
+    notes = events_to_notes(events, meta, track)
+    bpm = meta["bpm"]
+    durations = notes.durations
+    if "beat_size" in meta:
+        beat_size = meta["beat_size"]
+    else:
+        beat_size = 60 / (bpm * durations[durations > 0].min()) if len(durations) else 4.0
+    slot = 60 / (bpm * beat_size)
+    tokens = []
+    ends = numpy.cumsum(durations)
+    edge = 0
+    for i, note_data in enumerate(notes):
+        end = max(edge + 1, int(round(ends[i] / slot)))
+        tokens += [note_data["note"]] + [""] * (end - edge - 1)
+        edge = end
+    # A newline separates tokens just like a comma does
+    lines = [
+        ",".join(tokens[i : i + TEXT_LINE_LENGTH])
+        for i in range(0, len(tokens), TEXT_LINE_LENGTH)
+    ]
+    return f"{int(round(bpm))} {float(beat_size)}\n" + "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("import", "export"):
+        print(f"Usage: python {sys.argv[0]} import <song.txt>")
+        print(f"       python {sys.argv[0]} export <song.npz> [<track>]")
+        sys.exit(1)
+
+    path = sys.argv[2]
+    base_name = os.path.splitext(path)[0]
+    if sys.argv[1] == "import":
+        events, meta = text_to_events(path)
+        save_events(base_name + ".npz", events, meta)
+        print(f"{len(events)} notes saved to {base_name}.npz")
+    else:
+        events, meta = load_events(path)
+        track = sys.argv[3] if len(sys.argv) > 3 else None
+        tracks = [track] if track is not None else sorted(set(events["track"].tolist()))
+        for track in tracks:
+            track_name = meta["tracks"][get_track_index(meta, track)]
+            with open(f"{base_name}_{track_name}.txt", "w", encoding="utf-8") as f:
+                f.write(events_to_text(events, meta, track))
+            print(f"Track {track_name} saved to {base_name}_{track_name}.txt")
@@ -0,0 +1,192 @@
+import os
+import tempfile
+import threading
+from queue import Full, Queue
+
+import numpy
+from tqdm import tqdm
+
+from audio_render import CROSSFADE_MS, get_note_end, get_store_note_audio, mix_notes, shift_note_audio
+from frame_store import CHANNELS
+from notes import get_note_starts
+from pipe_renderer import FrameWriter, close_encoder, map_frames, open_encoder
+from pitch_resolver import resolve_notes
+from tracing import count, span
+
+STREAM_WINDOW = float(os.environ.get("STREAM_WINDOW", "10"))  # Seconds of song prepared at once
+STREAM_LOOKAHEAD = int(os.environ.get("STREAM_LOOKAHEAD", "2"))  # Windows prepared ahead of the writer
+
+
+def get_windows(notes, window=STREAM_WINDOW):
+    """
+    Note index ranges of about window seconds each, every range starts on a note.
+    """
+    starts, _ = get_note_starts(notes)
+    if not len(starts):
+        return []
+    cuts = numpy.searchsorted(starts, numpy.arange(window, starts[-1] + window, window))
+    edges = sorted(set([0, *[int(cut) for cut in cuts if cut < len(starts)], len(starts)]))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def get_last_windows(resolved, windows):
+    """
+    Index of the last window every resolution is used in.
+    """
+    last = {}
+    for i, (first, end) in enumerate(windows):
+        for resolution in resolved[first:end]:
+            last[resolution] = i
+    return last
+
+
+def prefetch(iterable, ahead=STREAM_LOOKAHEAD):
+    """
+    Consume iterable in a background thread, staying at most ahead items in
+    front of the caller. Exceptions are raised in the caller. When the caller
+    stops early or fails the producer stops too.
+    """
+    if ahead <= 0:
+        yield from iterable
+        return
+    queue = Queue(ahead)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except Exception as e:
+            put((False, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = queue.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_audio_blocks(store, resolved, notes, windows, shifted=None, crossfade_ms=CROSSFADE_MS):
+    """
+    Song audio one window at a time, the blocks joined are render_store_audio.
+    A note ringing past its window is carried into the next block. Shifts are
+    computed when their first window comes and dropped after their last one,
+    unless shifted is given and owned by the caller.
+    """
+    sample_rate = store.sample_rate
+    starts, durations = get_note_starts(notes)
+    total = int(round((starts[-1] + durations[-1]) * sample_rate)) if len(starts) else 0
+    fade = int(sample_rate * crossfade_ms / 1000)
+    note_audio = get_store_note_audio(store)
+    last_windows = get_last_windows(resolved, windows) if shifted is None else None
+    cache = shifted if shifted is not None else {}
+    carry = numpy.zeros((0, CHANNELS), numpy.float32)
+    offset = 0
+    for i, (first, end) in enumerate(windows):
+        window_resolved = resolved[first:end]
+        if last_windows is not None:
+            missing = [
+                resolution
+                for resolution in dict.fromkeys(window_resolved)
+                if resolution is not None and resolution not in cache
+            ]
+            if missing:
+                cache.update(shift_note_audio(note_audio, missing))
+        boundary = int(round(starts[end] * sample_rate)) if end < len(starts) else total
+        block_end = max(
+            [offset + len(carry), boundary]
+            + [
+                get_note_end(cache[resolution], int(round(starts[first + j] * sample_rate)), durations[first + j], sample_rate, fade)
+                for j, resolution in enumerate(window_resolved)
+                if resolution is not None
+            ]
+        )
+        block = numpy.zeros((min(block_end, total) - offset, CHANNELS), numpy.float32)
+        block[: len(carry)] = carry
+        mix_notes(block, offset, window_resolved, starts[first:end], durations[first:end], cache, sample_rate, crossfade_ms)
+        yield block[: boundary - offset]
+        carry = block[boundary - offset :]
+        offset = boundary
+        if last_windows is not None:
+            done = [resolution for resolution in cache if last_windows[resolution] == i]
+            for resolution in done:
+                del cache[resolution]
+            count("stream.dropped_shifts", len(done))
+
+
+def get_first_frame(time, fps):
+    """
+    Number of the first frame shown at or after time, consistent with the
+    frame / fps times of compile_timeline.
+    """
+    frame = int(numpy.ceil(time * fps))
+    while frame > 0 and (frame - 1) / fps >= time:
+        frame -= 1
+    while frame / fps < time:
+        frame += 1
+    return frame
+
+
+def iter_frame_windows(store, resolved, notes, windows):
+    """
+    compile_timeline one window at a time.
+    """
+    starts, durations = get_note_starts(notes)
+    total = starts[-1] + durations[-1] if len(starts) else 0
+    frame_count = int(numpy.ceil(total * store.fps - 1e-9))
+    for first, end in windows:
+        first_frame = get_first_frame(starts[first], store.fps)
+        end_frame = get_first_frame(starts[end], store.fps) if end < len(starts) else frame_count
+        yield map_frames(
+            store,
+            resolved[first:end],
+            starts[first:end],
+            durations[first:end],
+            numpy.arange(first_frame, min(end_frame, frame_count)),
+        )
+
+
+def render_song_streaming(out_file, store, mapping_data, notes, codec, shifted=None, window=STREAM_WINDOW):
+    """
+    Render in windows of window seconds so memory stays flat however long the
+    song is. Audio is mixed and written to disk first, then frames are
+    streamed to the encoder.
+    """
+    resolved = resolve_notes(mapping_data, notes)
+    windows = get_windows(notes, window)
+    print(f"Windows: {len(windows)} of {window:g}s | Look-ahead: {STREAM_LOOKAHEAD}")
+    fd, audio_path = tempfile.mkstemp(suffix=".f32")
+    frame_count = 0
+    try:
+        with os.fdopen(fd, "wb") as f, span("stream_audio", "audio", windows=len(windows)):
+            blocks = prefetch(iter_audio_blocks(store, resolved, notes, windows, shifted))
+            for block in tqdm(blocks, desc="Audio", total=len(windows)):
+                f.write(numpy.ascontiguousarray(block, numpy.float32).data)
+        process = open_encoder(out_file, store.size, store.fps, codec, audio_path, store.sample_rate)
+        writer = FrameWriter(process, store)
+        with span("stream_frames", "encode", out_file=out_file):
+            for frame_indices in tqdm(iter_frame_windows(store, resolved, notes, windows), desc="Frames", total=len(windows)):
+                writer.write(frame_indices)
+                frame_count += len(frame_indices)
+            close_encoder(process, out_file)
+    finally:
+        os.remove(audio_path)
+    return frame_count / store.fps
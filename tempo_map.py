@@ -0,0 +1,66 @@
+import numpy
+
+DEFAULT_TEMPO = 500000  # Microseconds per beat, 120 BPM until the first set_tempo
+
+
+class TempoMap:
+    """
+    Tempo changes of a MIDI file as sorted arrays: the tick each tempo starts
+    at, the seconds elapsed by then and the seconds per tick from there on.
+    Ticks are converted with one binary search per array, not a walk over the
+    changes.
+    """
+
+    def __init__(self, ticks, tempos, ticks_per_beat):
+        ticks = numpy.asarray(ticks, dtype=numpy.int64)
+        tempos = numpy.asarray(tempos, dtype=numpy.float64)
+        order = numpy.argsort(ticks, kind="stable")
+        ticks, tempos = ticks[order], tempos[order]
+        # The last of several changes on the same tick wins
+        keep = numpy.append(ticks[1:] != ticks[:-1], True)
+        ticks, tempos = ticks[keep], tempos[keep]
+        if not len(ticks) or ticks[0] > 0:
+            ticks = numpy.append(0, ticks)
+            tempos = numpy.append(DEFAULT_TEMPO, tempos)
+        self.ticks_per_beat = ticks_per_beat
+        self.ticks = ticks
+        self.tempos = tempos
+        self.seconds_per_tick = tempos / 1e6 / ticks_per_beat
+        self.seconds = numpy.zeros(len(ticks))
+        numpy.cumsum(numpy.diff(ticks) * self.seconds_per_tick[:-1], out=self.seconds[1:])
+
+    def __len__(self):
+        return len(self.ticks)
+
+    @property
+    def bpm(self):
+        """
+        Tempo the song starts at.
+        """
+        return 60e6 / self.tempos[0]
+
+    def find(self, ticks):
+        return numpy.searchsorted(self.ticks, ticks, "right") - 1
+
+    def to_seconds(self, ticks):
+        ticks = numpy.asarray(ticks, dtype=numpy.float64)
+        index = self.find(ticks)
+        return self.seconds[index] + (ticks - self.ticks[index]) * self.seconds_per_tick[index]
+
+    def to_reference_ticks(self, ticks):
+        """
+        Ticks at the starting tempo that take as long as ticks do under the
+        map, rounded to whole ticks. Unchanged before the first tempo change.
+        """
+        ticks = numpy.asarray(ticks, dtype=numpy.int64)
+        index = self.find(ticks)
+        ratio = self.seconds_per_tick / self.seconds_per_tick[0]
+        starts = self.seconds / self.seconds_per_tick[0]
+        return numpy.rint(starts[index] + (ticks - self.ticks[index]) * ratio[index]).astype(numpy.int64)
+
+    def to_dict(self):
+        return {
+            "ticks": self.ticks.tolist(),
+            "seconds": self.seconds.tolist(),
+            "bpm": (60e6 / self.tempos).tolist(),
+        }
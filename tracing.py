@@ -0,0 +1,194 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# "true" (or 1, yes, on) writes the trace next to the output, any other value is used as the trace path
+TRACE = os.environ.get("TRACE", "").strip()
+TRACE_TRUE = ("true", "1", "yes", "on")
+TRACE_ENABLED = TRACE.lower() not in ("", "false", "0", "no", "off")
+
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def _now():
+    return (time.perf_counter() - _origin) * 1e6  # Chrome traces are in microseconds
+
+
+@contextmanager
+def _span(name, category, args):
+    start = _now()
+    try:
+        yield
+    finally:
+        _events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start,
+                "dur": _now() - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+
+def span(name, category="stage", **args):
+    """
+    Time the enclosed block. Returns a shared no-op context when tracing is off.
+    """
+    if not TRACE_ENABLED:
+        return NULL_SPAN
+    return _span(name, category, args)
+
+
+def traced(name=None, category="stage"):
+    """
+    Decorator version of span, named after the function by default.
+    """
+
+    def decorator(function):
+        if not TRACE_ENABLED:
+            return function
+        span_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with _span(span_name, category, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    if not TRACE_ENABLED:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+    _events.append(
+        {
+            "name": name,
+            "ph": "C",
+            "ts": _now(),
+            "pid": os.getpid(),
+            "args": {name: total},
+        }
+    )
+
+
+def get_peak_memory():
+    """
+    Peak resident memory of this process in bytes, None if it cannot be read.
+    """
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Kilobytes on Linux
+
+
+def print_peak_memory():
+    peak = get_peak_memory()
+    if peak is not None:
+        print(f"Peak memory: {peak / 2**20:.0f} MiB")
+    return peak
+
+
+def export_chrome_trace(path):
+    """
+    Write the recorded events in the Chrome trace format, viewable in
+    chrome://tracing or Perfetto.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": list(_events), "displayTimeUnit": "ms"}, f)
+
+
+def get_summary():
+    """
+    Count, total and longest duration in seconds of every span name, and the
+    final value of every counter.
+    """
+    spans = {}
+    for event in list(_events):
+        if event["ph"] != "X":
+            continue
+        entry = spans.setdefault(event["name"], {"count": 0, "total": 0.0, "max": 0.0})
+        entry["count"] += 1
+        entry["total"] += event["dur"] / 1e6
+        entry["max"] = max(entry["max"], event["dur"] / 1e6)
+    return spans, dict(_counters)
+
+
+def print_summary():
+    spans, counters = get_summary()
+    wall = _now() / 1e6
+    print(f"{'Span':<24}{'count':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}{'% wall':>8}")
+    for name, entry in sorted(spans.items(), key=lambda item: -item[1]["total"]):
+        print(
+            f"{name:<24}{entry['count']:>8}{entry['total']:>10.3f}"
+            f"{entry['total'] / entry['count'] * 1000:>10.2f}{entry['max'] * 1000:>10.2f}"
+            f"{entry['total'] / wall:>8.1%}"
+        )
+    for name, value in sorted(counters.items()):
+        print(f"{name:<24}{value:>8}")
+
+
+def finish(default_path):
+    """
+    Print the summary and write the trace, to TRACE if it is a path or to
+    default_path otherwise. Does nothing when tracing is off.
+    """
+    if not TRACE_ENABLED:
+        return None
+    path = default_path if TRACE.lower() in TRACE_TRUE else TRACE
+    print_summary()
+    export_chrome_trace(path)
+    print(f"Trace saved to {path}")
+    return path
@@ -2,11 +2,13 @@ import json
 import os
 import sys
 
-from pydub import AudioSegment, silence
-
+from segmentation import MIN_SILENCE_LEN, SILENCE_OFFSET, segment_video
 from transformations import seconds_to_sample
 
 DATA_FOLDER = "input"
+MIN_SILENCE = int(os.environ.get("MIN_SILENCE_LEN", MIN_SILENCE_LEN))
+SILENCE_DB = float(os.environ.get("SILENCE_OFFSET", SILENCE_OFFSET))
+ONSET_DB = os.environ.get("ONSET_DB")
 
 input_string = "C C# D D# E F F# G G# A A# B".split()
 
@@ -41,10 +43,15 @@ def audio_to_samples(audio_array, sample_rate):
     ]
 
 
-def samples_to_dict(samples):
+def get_note_names(spoken_characters):
+    return spoken_characters.strip().upper().split()
+
+
+def samples_to_dict(samples, names=None):
+    names = names or input_string
     dict_ = {}
     for i, (start, end) in enumerate(samples):
-        dict_[input_string[i]] = {"start": start, "length": end - start}
+        dict_[names[i]] = {"start": start, "length": end - start}
     return dict_
 
 
@@ -58,8 +65,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     if len(sys.argv) > 2:
-        input_string = sys.argv[2].strip()
-        input_string = input_string.upper().split()
+        input_string = get_note_names(sys.argv[2])
         print(f"Input String reset to: {input_string}")
 
     input_video_name = fix_input_path(sys.argv[1].strip())
@@ -73,16 +79,17 @@ if __name__ == "__main__":
     print(f"Loading video: {input_video_name}")
     print(f"Actor -> {actor}")
 
-    myaudio = AudioSegment.from_file(input_video_name, extension) + 5
-    sample_rate = myaudio.frame_rate
-    dBFS = myaudio.dBFS
+    audio_info, signal = segment_video(
+        input_video_name,
+        min_silence_len=MIN_SILENCE,
+        silence_offset=SILENCE_DB,
+        onset_db=float(ONSET_DB) if ONSET_DB else None,
+    )
+    sample_rate = signal.sample_rate
 
     print(f"Sample Rate: {sample_rate}")
-    print(f"dBFS: {dBFS}")
+    print(f"dBFS: {signal.dBFS}")
 
-    audio_info = silence.detect_nonsilent(
-        myaudio, min_silence_len=250, silence_thresh=dBFS - 16
-    )
     audio_info = audio_to_samples(audio_info, sample_rate)
 
     if len(audio_info) != len(input_string):